@@ -0,0 +1,213 @@
+#! /usr/bin/python
+
+#-----------------------------------------------------------------------------------------------------------------------------------------------------------
+# Vision benchmark on recorded runs (see bot_recording.py; record with: reading_signs.py --record run.rec)
+# - replays every frame of the recordings through find_marker (full frame and ROI tracking),
+#   filter_sign and compare_images of reading_signs.py
+# - reports per function: calls, throughput and latency percentiles
+# - --save stores the figures as JSON; --compare fails (exit code 1) when a function got slower
+#   than the saved baseline times the tolerance, to catch regressions before they hit the track
+# - --denoisers times the sign extraction in the marker crop with every denoiser and counts how often its
+#   rectangles and the sign they read agree with the baseline: bilateral filter on the masked colour image of the
+#   full frame; pick the cheapest one that always agrees
+#
+# Usage: python benchmark_vision.py run1.rec run2.rec --save baseline.json
+#        python benchmark_vision.py run1.rec run2.rec --compare baseline.json
+#        python benchmark_vision.py run1.rec run2.rec --denoisers
+#-----------------------------------------------------------------------------------------------------------------------------------------------------------
+import sys
+import json
+import argparse
+import timeit
+import numpy as np
+import reading_signs
+import bot_recording
+import command_scheduler
+import frame_cache
+import change_detection
+import colour_calibration
+import marker_tracking
+import sign_matching
+
+clock = timeit.default_timer
+# -------------------------------------------------------------------------------------
+# Time one call and keep the latency under its name
+# -------------------------------------------------------------------------------------
+def timed(timings, name, function, *args, **kwargs):
+    start = clock()
+    result = function(*args, **kwargs)
+    timings.setdefault(name, []).append(clock() - start)
+    return result
+# -------------------------------------------------------------------------------------
+# Run all frames of one recording through the vision functions
+# -------------------------------------------------------------------------------------
+def benchmark_recording(path, timings, roi_level, calibration=None, change_threshold=12):
+    bot = bot_recording.ReplayBot(path, preload=True)                                # decoding is not part of the figures
+    reading_signs.change_detector = change_detection.ChangeDetector(threshold=0)     # timed passes: every frame processed
+    reading_signs.sign_cache = None
+    reading_signs.bot = bot
+    reading_signs.commands = command_scheduler.CommandScheduler(bot, max_rate=1000.0)
+    reading_signs.camera = frame_cache.FrameSource(bot, reading_signs.lower_blue, reading_signs.upper_blue, max_age=0,
+                                                   calibration=calibration)
+    reading_signs.marker_tracker = marker_tracking.MultiMarkerTracker(level=roi_level)
+    frames = len(bot.frames)
+    start = clock()
+    for _ in xrange(frames):                                                          # full frame search
+        timed(timings, 'find_marker', reading_signs.find_marker)
+    all_frames = clock() - start
+    bot.rewind()
+    reading_signs.marker_tracker.reset()
+    reading_signs.change_detector.reset()
+    for _ in xrange(frames):                                                          # ROI tracking
+        timed(timings, 'find_marker(tracking)', reading_signs.find_marker, tracking=True)
+    bot.rewind()
+    reading_signs.marker_tracker.reset()
+    reading_signs.change_detector.reset()
+    for _ in xrange(frames):                                                          # sign reading
+        reading_signs.find_marker()
+        sign_filtered, quads = timed(timings, 'filter_sign', reading_signs.filter_sign)
+        if sign_filtered == 1:
+            timed(timings, 'compare_images', reading_signs.compare_images, quads)
+    if change_threshold:                                                              # savings; not part of the baseline
+        bot.rewind()
+        reading_signs.marker_tracker.reset()
+        detector = change_detection.ChangeDetector(threshold=change_threshold)
+        reading_signs.change_detector = detector
+        start = clock()
+        for _ in xrange(frames):
+            reading_signs.find_marker()
+        skipping = clock() - start
+        print '%s: change detection skipped %d of %d frames; find_marker %.1f s -> %.1f s' % (
+            path, detector.skipped, frames, all_frames, skipping)
+# -------------------------------------------------------------------------------------
+# Returns: True when both lists hold the same rectangles, corners within tolerance pixels
+# -------------------------------------------------------------------------------------
+def quads_agree(quads, reference, tolerance=4):
+    if len(quads) != len(reference):
+        return False
+    for quad, expected in zip(quads, reference):
+        corners = sorted(map(tuple, quad.reshape(4, 2)))
+        expected = sorted(map(tuple, expected.reshape(4, 2)))
+        if np.abs(np.array(corners) - np.array(expected)).max() > tolerance:
+            return False
+    return True
+# -------------------------------------------------------------------------------------
+# Returns: name of the best matching sign of the rectangles (NO_MATCH without any)
+# -------------------------------------------------------------------------------------
+def sign_label(quads):
+    best = (sign_matching.NO_MATCH, float('inf'))
+    for quad in quads:
+        name, score, _ = reading_signs.sign_templates.match(reading_signs.warp_sign(quad))
+        if score < best[1]:
+            best = (name, score)
+    return best[0]
+# -------------------------------------------------------------------------------------
+# Sign extraction in the marker crop with every denoiser against the baseline: full frame,
+# bilateral filter on the masked colour image (the extraction before the ROI and denoiser options)
+# -------------------------------------------------------------------------------------
+def benchmark_denoisers(path, timings, agreement, roi_level, calibration=None):
+    bot = bot_recording.ReplayBot(path, preload=True)
+    reading_signs.change_detector = change_detection.ChangeDetector(threshold=0)     # every frame of this recording; no reuse
+    reading_signs.sign_cache = None
+    reading_signs.commands = command_scheduler.CommandScheduler(bot, max_rate=1000.0)
+    reading_signs.camera = frame_cache.FrameSource(bot, reading_signs.lower_blue, reading_signs.upper_blue, max_age=0,
+                                                   calibration=calibration)
+    reading_signs.marker_tracker = marker_tracking.MultiMarkerTracker(level=roi_level)
+    for _ in xrange(len(bot.frames)):
+        reading_signs.find_marker()
+        frame = reading_signs.frame
+        reference = timed(timings, 'full frame baseline', sign_matching.extract_quads, frame, None, 'bilateral')
+        if not reference or reading_signs.marker_box is None:                        # no sign to agree on
+            continue
+        reference_label = sign_label(reference)
+        roi = sign_matching.sign_roi(reading_signs.marker_box, frame.raw.shape)
+        for denoise in sign_matching.denoisers:
+            quads = timed(timings, 'crop ' + denoise, sign_matching.extract_quads, frame, roi, denoise)
+            agreed, labelled, frames = agreement.get(denoise, (0, 0, 0))
+            agreement[denoise] = (agreed + quads_agree(quads, reference),
+                                  labelled + (sign_label(quads) == reference_label), frames + 1)
+def print_agreement(agreement):
+    print '%-24s %7s %9s %9s' % ('denoiser', 'frames', 'agree %', 'sign %')
+    for denoise in sorted(agreement):
+        agreed, labelled, frames = agreement[denoise]
+        print '%-24s %7d %9.1f %9.1f' % (denoise, frames, 100.0 * agreed / frames, 100.0 * labelled / frames)
+# -------------------------------------------------------------------------------------
+# Returns: {name: {calls, per_second, p50, p90, p99, max}} with latencies in ms
+# -------------------------------------------------------------------------------------
+def summarize(timings):
+    summary = {}
+    for name, latencies in timings.items():
+        latencies = np.array(latencies) * 1000.0
+        p50, p90, p99 = np.percentile(latencies, [50, 90, 99])
+        summary[name] = {'calls': len(latencies),
+                         'per_second': len(latencies) / (latencies.sum() / 1000.0),
+                         'p50': p50, 'p90': p90, 'p99': p99, 'max': latencies.max()}
+    return summary
+def print_summary(summary):
+    print '%-24s %7s %9s %8s %8s %8s %8s' % ('function', 'calls', 'calls/s', 'p50 ms', 'p90 ms', 'p99 ms', 'max ms')
+    for name in sorted(summary):
+        figures = summary[name]
+        print '%-24s %7d %9.1f %8.2f %8.2f %8.2f %8.2f' % (name, figures['calls'], figures['per_second'],
+                                                            figures['p50'], figures['p90'],
+                                                            figures['p99'], figures['max'])
+# -------------------------------------------------------------------------------------
+# Returns: names of functions whose median latency exceeds baseline * tolerance
+# -------------------------------------------------------------------------------------
+def regressions(summary, baseline, tolerance):
+    slower = []
+    for name, figures in sorted(summary.items()):
+        if name in baseline and figures['p50'] > baseline[name]['p50'] * tolerance:
+            print 'REGRESSION %-24s p50 %.2f ms > %.2f ms baseline' % (name, figures['p50'], baseline[name]['p50'])
+            slower.append(name)
+    return slower
+#--------------------------------------------------------------------------------------
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser( "Benchmarks the vision functions on recorded runs" )
+    parser.add_argument( "recordings", nargs='+',
+                         help="Files recorded with reading_signs.py --record" )
+    parser.add_argument( "--signs", default=".",
+                         help="Directory with the reference sign images (sign*.jpg)" )
+    parser.add_argument( "--roi-level", type=int, default=0,
+                         help="Pyramid level used when tracking the marker in a ROI (0 = full size)" )
+    parser.add_argument( "--calibration", metavar="FILE",
+                         help="Colour calibration file (JSON HSV ranges)" )
+    parser.add_argument( "--change-threshold", type=int, default=12,
+                         help="Grey levels a signature cell must change before a frame is processed again (0 = only skip repeated images)" )
+    parser.add_argument( "--sign-denoise", default=reading_signs.sign_denoise, choices=sorted(sign_matching.denoisers),
+                         help="Denoiser of the sign extraction" )
+    parser.add_argument( "--denoisers", action="store_true",
+                         help="Compare the sign extraction denoisers instead of benchmarking the functions" )
+    parser.add_argument( "--save", metavar="FILE",
+                         help="Store the results as JSON baseline" )
+    parser.add_argument( "--compare", metavar="FILE",
+                         help="Compare with a JSON baseline; exit code 1 on regressions" )
+    parser.add_argument( "--tolerance", type=float, default=1.2,
+                         help="Allowed slowdown factor of the median latency" )
+    args = parser.parse_args()
+    reading_signs.sign_templates = sign_matching.SignTemplates( args.signs )
+    reading_signs.sign_denoise = args.sign_denoise
+    calibration = None
+    if args.calibration:
+        calibration = colour_calibration.ColourCalibration( reading_signs.lower_blue, reading_signs.upper_blue,
+                                                            path=args.calibration )
+    timings = {}
+    if args.denoisers:
+        agreement = {}
+        for path in args.recordings:
+            benchmark_denoisers( path, timings, agreement, args.roi_level, calibration )
+        print_summary( summarize( timings ) )
+        if agreement:
+            print_agreement( agreement )
+        sys.exit(0)
+    for path in args.recordings:
+        benchmark_recording( path, timings, args.roi_level, calibration, args.change_threshold )
+    summary = summarize( timings )
+    print_summary( summary )
+    if args.save:
+        with open( args.save, 'w' ) as baseline_file:
+            json.dump( summary, baseline_file, indent=2, sort_keys=True )
+    if args.compare:
+        with open( args.compare ) as baseline_file:
+            baseline = json.load( baseline_file )
+        if regressions( summary, baseline, args.tolerance ):
+            sys.exit(1)
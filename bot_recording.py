@@ -0,0 +1,142 @@
+#! /usr/bin/python
+
+#-----------------------------------------------------------------------------------------------------------------------------------------------------------
+# Record and replay robot runs for reading_signs.py
+# - RecordingBot wraps a WebsocketsBot and stores every new camera frame (JPEG), its timestamp and
+#   every get_robot_status_dict answer in one file
+# - ReplayBot is a drop-in fake WebsocketsBot: it plays a recording back frame by frame, always in the
+#   same order, so find_marker, filter_sign and compare_images can be profiled and tested without the robot
+#
+# File format: a stream of pickled records (kind, timestamp, data)
+#              kind 'frame'  -> data is the JPEG encoded camera image
+#              kind 'status' -> data is the robot status dict
+#-----------------------------------------------------------------------------------------------------------------------------------------------------------
+import bisect
+import pickle
+import threading
+import cv2
+import numpy as np
+# -------------------------------------------------------------------------------------
+# Set and initialize variables
+# -------------------------------------------------------------------------------------
+jpeg_quality = 90                                                                     # compact; replays always decode the same pixels
+# -------------------------------------------------------------------------------------
+# Read all records of a recording
+#
+# Returns: list of (kind, timestamp, data)
+# -------------------------------------------------------------------------------------
+def read_records(path):
+    records = []
+    with open(path, 'rb') as record_file:
+        while True:
+            try:
+                records.append(pickle.load(record_file))
+            except EOFError:
+                break
+    return records
+def decode_frame(data):
+    return cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR)
+# -------------------------------------------------------------------------------------
+# Real robot; everything it sees is written to disk
+# -------------------------------------------------------------------------------------
+class RecordingBot(object):
+    def __init__(self, bot, path):
+        self.bot = bot
+        self.record_file = open(path, 'wb')
+        self.write_lock = threading.Lock()                                            # sensor thread and main loop both write
+        self.last_frame_time = None
+        self.frames_recorded = 0
+    def __getattr__(self, name):                                                      # everything else goes to the real bot
+        return getattr(self.bot, name)
+    def write(self, kind, timestamp, data):
+        with self.write_lock:                                                         # pickle.dump writes in pieces; never interleave
+            pickle.dump((kind, timestamp, data), self.record_file, pickle.HIGHEST_PROTOCOL)
+    def get_latest_camera_image(self, *args, **kwargs):
+        image, image_time = self.bot.get_latest_camera_image(*args, **kwargs)
+        if image is not None and image_time != self.last_frame_time:                  # same frame asked twice: store once
+            ok, data = cv2.imencode('.jpg', image, [int(cv2.IMWRITE_JPEG_QUALITY), jpeg_quality])
+            if ok:
+                self.write('frame', image_time, data.tobytes())
+                self.last_frame_time = image_time
+                self.frames_recorded += 1
+        return image, image_time
+    def get_robot_status_dict(self, *args, **kwargs):
+        status_dict, read_time = self.bot.get_robot_status_dict(*args, **kwargs)
+        self.write('status', read_time, status_dict)
+        return status_dict, read_time
+    def disconnect(self):
+        with self.write_lock:
+            self.record_file.close()
+        print 'Frames recorded .....................', self.frames_recorded
+        self.bot.disconnect()
+# -------------------------------------------------------------------------------------
+# Fake robot; plays a recording back. Commands are counted, not executed
+# -------------------------------------------------------------------------------------
+class ReplayBot(object):
+    def __init__(self, path, preload=False):
+        self.frames = []                                                              # (timestamp, JPEG data or image)
+        self.statuses = []                                                            # (timestamp, status dict)
+        for kind, timestamp, data in read_records(path):
+            if kind == 'frame':
+                if preload:                                                           # decode up front (benchmarks)
+                    data = decode_frame(data)
+                self.frames.append((timestamp, data))
+            elif kind == 'status':
+                self.statuses.append((timestamp, data))
+        self.status_times = [timestamp for timestamp, _ in self.statuses]
+        self.preload = preload
+        self.position = -1
+        self.commands = {}
+        print 'Frames in recording .................', len(self.frames)
+    def clock(self):                                                                  # replay time: the current frame is always fresh
+        return self.frame_time()
+    def rewind(self):
+        self.position = -1
+    def frame_time(self):
+        if not self.frames:
+            return 0.0
+        if self.position < 0:
+            return self.frames[0][0]
+        return self.frames[self.position][0]
+    # ---------------------------------------------------------------------------------
+    # Every call returns the next recorded frame
+    # ---------------------------------------------------------------------------------
+    def get_latest_camera_image(self, timeout=None):
+        if self.position + 1 >= len(self.frames):
+            raise EOFError('End of recording')
+        self.position += 1
+        image_time, data = self.frames[self.position]
+        if not self.preload:
+            data = decode_frame(data)
+        return data, image_time
+    # ---------------------------------------------------------------------------------
+    # Latest status recorded at or before the current frame
+    # ---------------------------------------------------------------------------------
+    def get_robot_status_dict(self):
+        index = bisect.bisect_right(self.status_times, self.frame_time()) - 1
+        if index < 0:
+            if not self.statuses:
+                raise EOFError('No sensor data in recording')
+            index = 0
+        status_time, status_dict = self.statuses[index]
+        return status_dict, status_time
+    def count(self, name):
+        self.commands[name] = self.commands.get(name, 0) + 1
+    def set_motor_speeds(self, left, right):
+        self.count('set_motor_speeds')
+    def set_neck_angles(self, pan, tilt):
+        self.count('set_neck_angles')
+    def centre_neck(self):
+        self.count('centre_neck')
+    def update(self):
+        pass
+    def start_streaming_camera_images(self):
+        pass
+    def stop_streaming_camera_images(self):
+        pass
+    def get_robot_config(self):
+        return None
+    def set_robot_config(self, robot_config):
+        pass
+    def disconnect(self):
+        print 'Replayed frames .....................', self.position + 1
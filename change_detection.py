@@ -0,0 +1,61 @@
+#! /usr/bin/python
+
+#-----------------------------------------------------------------------------------------------------------------------------------------------------------
+# Frame change detection for reading_signs.py
+# - a frame is reduced to a tiny colour signature (e.g. 40 x 30 cells of 16 x 16 pixels; area averaged)
+# - the signature is compared with the one of the last processed frame, not with the previous frame, so a slow
+#   drift adds up until the frame is processed again
+# - the largest cell difference decides: a marker big enough to count fills whole cells, so it is not averaged
+#   away by an otherwise unchanged scene
+# - the same camera image (same sequence number) is never processed twice
+# - after max_skips frames in a row or max_reuse seconds a frame is processed anyway
+#-----------------------------------------------------------------------------------------------------------------------------------------------------------
+import cv2
+import numpy as np
+import command_scheduler
+
+class ChangeDetector(object):
+    def __init__(self, size=(40, 30), threshold=12, max_skips=30, max_reuse=1.0):
+        self.size = size                                                              # signature cells (width, height)
+        self.threshold = threshold                                                    # grey levels per cell and channel; 0 = off
+        self.max_skips = max_skips
+        self.max_reuse = max_reuse                                                    # seconds a result may be reused
+        self.skipped = 0
+        self.processed = 0
+        self.reset()
+    def reset(self):                                                                  # next frame is processed (e.g. neck moved)
+        self.signature = None
+        self.seq = None
+        self.skips = 0
+        self.since = 0.0
+    def signature_of(self, frame):
+        return cv2.resize(frame.raw, self.size, interpolation=cv2.INTER_AREA).astype(np.int16)
+    # ---------------------------------------------------------------------------------
+    # Input: Frame; same_seq_only: only the very same camera image may be skipped (tracking)
+    # Returns: True when the frame must be processed; False to reuse the last result
+    # ---------------------------------------------------------------------------------
+    def changed(self, frame, same_seq_only=False):
+        now = command_scheduler.monotonic()
+        if self.seq is None or self.skips >= self.max_skips or now - self.since > self.max_reuse:
+            return self.process(frame, now, same_seq_only)
+        if frame.seq == self.seq:
+            return self.skip()
+        if not self.threshold or same_seq_only:
+            return self.process(frame, now, same_seq_only)
+        signature = self.signature_of(frame)
+        if self.signature is not None and np.abs(signature - self.signature).max() < self.threshold:
+            return self.skip()
+        return self.process(frame, now, signature=signature)
+    def skip(self):
+        self.skips += 1
+        self.skipped += 1
+        return False
+    def process(self, frame, now, same_seq_only=False, signature=None):
+        if signature is None and self.threshold and not same_seq_only:              # tracking: no signature needed
+            signature = self.signature_of(frame)
+        self.signature = signature
+        self.seq = frame.seq
+        self.skips = 0
+        self.since = now
+        self.processed += 1
+        return True
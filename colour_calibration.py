@@ -0,0 +1,63 @@
+#! /usr/bin/python
+
+#-----------------------------------------------------------------------------------------------------------------------------------------------------------
+# Colour calibration of the blue mask of reading_signs.py
+# - the HSV ranges of the marker can be kept in a calibration file and tuned at the venue while the robot runs
+# - ColourCalibration looks at the file about once a second and loads the ranges again when it changed; that is
+#   a few numbers, so it is done in place (no thread)
+# - lower and upper bound are replaced together in one assignment: a frame never gets the lower bound of one
+#   calibration and the upper bound of another
+#
+# Calibration file (JSON): {"lower": [110, 50, 50], "upper": [130, 255, 255]}
+#-----------------------------------------------------------------------------------------------------------------------------------------------------------
+import os
+import json
+import time
+import numpy as np
+# -------------------------------------------------------------------------------------
+# Returns: (lower, upper) HSV ranges of a calibration file
+# -------------------------------------------------------------------------------------
+def load_calibration(path):
+    with open(path) as calibration_file:
+        calibration = json.load(calibration_file)
+    return np.array(calibration['lower']), np.array(calibration['upper'])
+# -------------------------------------------------------------------------------------
+# Current HSV ranges; loaded again when the calibration file changes
+# -------------------------------------------------------------------------------------
+class ColourCalibration(object):
+    def __init__(self, lower, upper, path=None, check_interval=1.0):
+        self.path = path
+        self.check_interval = check_interval                                          # seconds between looks at the file
+        self.next_check = 0.0
+        self.mtime = None
+        self.reloads = 0
+        self.bounds = (lower, upper)
+        if path is not None and os.path.exists(path):
+            self.mtime = os.path.getmtime(path)
+            self.bounds = load_calibration(path)
+    # ---------------------------------------------------------------------------------
+    # Returns: the current (lower, upper) HSV ranges
+    # ---------------------------------------------------------------------------------
+    def current(self):
+        if self.path is not None:
+            now = time.time()
+            if now >= self.next_check:
+                self.next_check = now + self.check_interval
+                self.check()
+        return self.bounds
+    def check(self):
+        try:
+            mtime = os.path.getmtime(self.path)
+        except OSError:                                                               # file being replaced; next time
+            return
+        if mtime == self.mtime:
+            return
+        self.mtime = mtime
+        try:
+            bounds = load_calibration(self.path)
+        except (IOError, ValueError, KeyError) as error:                              # keep the old ranges
+            print 'Calibration not loaded ..............', self.path, error
+            return
+        self.bounds = bounds
+        self.reloads += 1
+        print 'Calibration loaded ..................', self.path, bounds[0], bounds[1]
@@ -0,0 +1,153 @@
+#! /usr/bin/python
+
+#-----------------------------------------------------------------------------------------------------------------------------------------------------------
+# Rate limited command layer for reading_signs.py
+# - wraps set_motor_speeds, set_neck_angles and update of a WebsocketsBot
+# - never sends more than max_rate requests per second to the web server on the robot (deadline based;
+#   no sleeps in the control flow to "avoid overload of the webserver")
+# - drops commands equal to the last one sent (e.g. repeated set_motor_speeds( 0.0, 0.0 ))
+# - merges pending commands of the same kind: only the latest one is sent
+# - timed_action runs motors for a precise time measured from the moment the command went out
+# - thread safe: the steering controller thread and the main loop share one scheduler; the scheduler lock only
+#   guards the queue, commands go out after it is released (one sender at a time)
+# - LockedBot: one lock around every call to the bot (socket I/O) of all threads: commands, camera, sensors
+#-----------------------------------------------------------------------------------------------------------------------------------------------------------
+import threading
+import time
+import timeit
+import stage_timing
+from stage_timing import timer
+# -------------------------------------------------------------------------------------
+# Clock of all deadlines. Python 2.7 has no time.monotonic:
+# - the 'monotonic' backport (pip install monotonic) when installed: monotonic and precise everywhere
+# - else timeit.default_timer: time.clock on Windows (sub-microsecond; the wall clock ticks every 15.6 ms there)
+#   and time.time elsewhere, which can jump when the system time is set (e.g. NTP on the Raspberry Pi)
+# -------------------------------------------------------------------------------------
+try:
+    from monotonic import monotonic
+except ImportError:
+    monotonic = getattr(time, 'monotonic', timeit.default_timer)
+unlocked = ('clock',)                                                                 # bot methods without I/O (ReplayBot)
+# -------------------------------------------------------------------------------------
+# The bot, with one I/O lock around every method call; the websocket bot is not thread safe
+# -------------------------------------------------------------------------------------
+class LockedBot(object):
+    def __init__(self, bot):
+        self.bot = bot
+        self.io_lock = threading.RLock()
+    def __getattr__(self, name):
+        attribute = getattr(self.bot, name)
+        if not callable(attribute) or name in unlocked:
+            return attribute
+        def locked(*args, **kwargs):
+            with self.io_lock:
+                return attribute(*args, **kwargs)
+        self.__dict__[name] = locked                                                  # next time found without __getattr__
+        return locked
+
+class CommandScheduler(object):
+    def __init__(self, bot, max_rate=25.0):
+        self.bot = bot
+        self.clock = getattr(bot, 'clock', time.time)                                 # same clock as the frame timestamps
+        self.lock = threading.RLock()                                                 # queue only; never held during I/O
+        self.send_lock = threading.Lock()                                             # one sender at a time; keeps the order
+        self.interval = 1.0 / max_rate
+        self.next_send = monotonic()
+        self.last_send = None                                                         # time the last command went out
+        self.pending = {}                                                             # kind -> latest arguments
+        self.order = []                                                               # kinds in order of arrival
+        self.sent = {}                                                                # kind -> arguments last sent
+        self.frame_times = {}                                                         # kind -> capture time of the frame behind it
+        self.queued_at = {}                                                           # kind -> time the latest arguments were queued
+        self.sent_count = 0
+        self.dropped_count = 0
+        self.merged_count = 0
+    # --------------------------------------------------------------------------------- Commands
+    def set_motor_speeds(self, left, right, frame_time=None):                        # frame_time: capture time of the frame used
+        self.queue('set_motor_speeds', (left, right), frame_time)
+    def set_neck_angles(self, pan, tilt):
+        self.queue('set_neck_angles', (pan, tilt))
+    def motor_speeds(self):                                                           # (left, right) last sent to the robot
+        return self.sent.get('set_motor_speeds', (0.0, 0.0))
+    def update(self):
+        self.bot.update()                                                             # background communications; not a request
+        self.pump()
+    # ---------------------------------------------------------------------------------
+    # Keep only the latest command of each kind; forget it when it equals what was sent
+    # ---------------------------------------------------------------------------------
+    def queue(self, kind, args, frame_time=None):
+        with self.lock:
+            self.frame_times[kind] = frame_time
+            self.queued_at[kind] = monotonic()
+            if kind in self.pending:
+                self.merged_count += 1
+                if self.sent.get(kind) == args:
+                    del self.pending[kind]
+                    self.order.remove(kind)
+                else:
+                    self.pending[kind] = args
+            elif self.sent.get(kind) == args:
+                self.dropped_count += 1
+            else:
+                self.pending[kind] = args
+                self.order.append(kind)
+        self.pump()                                                                   # sends outside the queue lock
+    # ---------------------------------------------------------------------------------
+    # Send pending commands whose deadline has passed; returns at once when another
+    # thread is sending (it sends what is pending)
+    # ---------------------------------------------------------------------------------
+    def pump(self):
+        if not self.send_lock.acquire(False):
+            return
+        try:
+            while True:
+                with self.lock:                                                       # take the command; queue stays open
+                    now = monotonic()
+                    if not self.order or now < self.next_send:
+                        return
+                    kind = self.order.pop(0)
+                    args = self.pending.pop(kind)
+                    frame_time = self.frame_times[kind]
+                    queued_at = self.queued_at[kind]
+                    self.sent[kind] = args
+                    self.sent_count += 1
+                    self.last_send = now
+                    self.next_send = now + self.interval
+                start = stage_timing.clock()
+                getattr(self.bot, kind)(*args)
+                if kind == 'set_motor_speeds':
+                    timer.record('motor_command', start)
+                    timer.add('queue_delay', (now - queued_at) * 1000.0)
+                    timer.frame_age(frame_time, self.clock())
+        finally:
+            self.send_lock.release()
+    # ---------------------------------------------------------------------------------
+    # Wait until a deadline, sending pending commands as soon as the rate allows
+    # ---------------------------------------------------------------------------------
+    def wait_until(self, deadline):
+        while True:
+            self.pump()
+            now = monotonic()
+            if now >= deadline:
+                return
+            wake = deadline
+            if self.order:                                                            # another thread may be sending it
+                wake = min(deadline, max(self.next_send, now + 0.001))
+            time.sleep(max(0.0, wake - now))
+    def wait(self, seconds):
+        self.wait_until(monotonic() + seconds)
+    def flush(self):                                                                  # block until everything pending is sent
+        while self.order:
+            self.wait_until(self.next_send)
+    # ---------------------------------------------------------------------------------
+    # Run the motors for a precise duration and stop them (turns, spins)
+    # ---------------------------------------------------------------------------------
+    def timed_action(self, left, right, duration):
+        start = monotonic()
+        self.set_motor_speeds(left, right)
+        self.flush()
+        if self.last_send is not None and self.last_send > start:                    # started when the command went out
+            start = self.last_send
+        self.wait_until(start + duration)
+        self.set_motor_speeds(0.0, 0.0)
+        self.flush()
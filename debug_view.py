@@ -0,0 +1,112 @@
+#! /usr/bin/python
+
+#-----------------------------------------------------------------------------------------------------------------------------------------------------------
+# Off-thread debug view for reading_signs.py
+# - the hot loop only hands over a frame and a list of annotations; it never draws, shows or waits for a key
+# - a background thread copies the frame, draws the annotations and shows it in a window or writes it
+#   to a local MJPEG file, at a capped rate per view (e.g. 5 fps); views not yet drawn are replaced by newer ones
+# - headless (enabled=False): show() returns at once; no GUI at all (Raspberry Pi without display)
+#
+# Annotations: ('rect', (x0, y0), (x1, y1), colour, thickness)
+#              ('contour', contour, colour, thickness)
+#              ('text', text, (x, y), colour, scale, thickness)
+#-----------------------------------------------------------------------------------------------------------------------------------------------------------
+import threading
+import cv2
+import command_scheduler
+# -------------------------------------------------------------------------------------
+# Set and initialize variables
+# -------------------------------------------------------------------------------------
+font = cv2.FONT_HERSHEY_SIMPLEX
+
+def fourcc(code):
+    if hasattr(cv2, 'VideoWriter_fourcc'):
+        return cv2.VideoWriter_fourcc(*code)
+    return cv2.cv.CV_FOURCC(*code)                                                    # OpenCV 2.4
+
+class DebugView(object):
+    def __init__(self, enabled=True, fps=5.0, video_path=None):
+        self.enabled = enabled
+        self.fps = fps
+        self.interval = 1.0 / fps
+        self.video_path = video_path                                                  # MJPEG file instead of windows
+        self.writer = None
+        self.next_show = {}                                                           # view name -> earliest next show
+        self.pending = {}                                                             # view name -> (image, annotations)
+        self.replaced = 0
+        self.condition = threading.Condition()
+        self.running = enabled
+        self.thread = None
+        if enabled:
+            self.thread = threading.Thread(target=self.run)
+            self.thread.daemon = True
+            self.thread.start()
+    # ---------------------------------------------------------------------------------
+    # Hand a view to the drawing thread; never blocks. The image must not be changed afterwards
+    # ---------------------------------------------------------------------------------
+    def show(self, name, image, annotations=()):
+        if not self.enabled:
+            return
+        now = command_scheduler.monotonic()
+        if now < self.next_show.get(name, 0.0):                                       # rate cap per view
+            return
+        self.next_show[name] = now + self.interval
+        with self.condition:
+            if name in self.pending:
+                self.replaced += 1
+            self.pending[name] = (image, annotations)
+            self.condition.notify()
+    def run(self):
+        while True:
+            with self.condition:
+                while self.running and not self.pending:
+                    self.condition.wait(0.1)
+                if not self.running and not self.pending:
+                    break
+                pending = self.pending
+                self.pending = {}
+            for name, (image, annotations) in pending.items():
+                self.output(name, self.draw(image, annotations))
+            if self.video_path is None:
+                cv2.waitKey(1)                                                        # same thread as imshow
+        if self.video_path is None:
+            cv2.destroyAllWindows()
+    def draw(self, image, annotations):
+        if not annotations:
+            return image
+        canvas = image.copy()
+        for annotation in annotations:
+            kind = annotation[0]
+            if kind == 'rect':
+                _, corner, opposite, colour, thickness = annotation
+                cv2.rectangle(canvas, corner, opposite, colour, thickness)
+            elif kind == 'contour':
+                _, contour, colour, thickness = annotation
+                cv2.drawContours(canvas, [contour], -1, colour, thickness)
+            elif kind == 'text':
+                _, text, position, colour, scale, thickness = annotation
+                cv2.putText(canvas, text, position, font, scale, colour, thickness)
+        return canvas
+    def output(self, name, canvas):
+        if self.video_path is None:
+            cv2.imshow(name, canvas)
+            return
+        if canvas.ndim == 2:
+            canvas = cv2.cvtColor(canvas, cv2.COLOR_GRAY2BGR)
+        if self.writer is None:
+            height, width = canvas.shape[:2]
+            self.writer = cv2.VideoWriter(self.video_path, fourcc('MJPG'), self.fps, (width, height))
+            self.size = (width, height)
+        if (canvas.shape[1], canvas.shape[0]) != self.size:                           # all views in one video
+            canvas = cv2.resize(canvas, self.size)
+        self.writer.write(canvas)
+    def close(self):
+        if self.thread is not None:
+            with self.condition:
+                self.running = False
+                self.condition.notify()
+            self.thread.join(2.0)
+            self.thread = None
+        if self.writer is not None:
+            self.writer.release()
+            self.writer = None
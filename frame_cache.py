@@ -0,0 +1,113 @@
+#! /usr/bin/python
+
+#-----------------------------------------------------------------------------------------------------------------------------------------------------------
+# Per-frame preprocessing cache for reading_signs.py
+# - one Frame object per captured camera image
+# - HSV conversion, blue mask and masked colour image are computed
+#   lazily on first use and then shared by every detector (find_marker, filter_sign, ...)
+# - the raw camera pixels are never drawn on; the debug view annotates its own copy
+# - every frame carries its capture time and sequence number; FrameSource refuses frames older than
+#   max_age and offers a barrier: wait for the first frame captured after time T (e.g. after a turn)
+# - with a colour calibration (colour_calibration.py) every frame gets the HSV ranges of that moment
+#-----------------------------------------------------------------------------------------------------------------------------------------------------------
+import time
+import cv2
+
+class Frame(object):
+    def __init__(self, raw, lower_blue, upper_blue, timestamp=0.0, seq=0):
+        self.raw = raw                                                                # camera pixels (BGR); vision input only
+        self.lower_blue = lower_blue
+        self.upper_blue = upper_blue
+        self.timestamp = timestamp                                                    # capture time (clock of the bot)
+        self.seq = seq                                                                # increments with every new camera image
+        self._hsv = None
+        self._mask = None
+        self._masked = None
+    # --------------------------------------------------------------------------------- 0 - Set color space
+    @property
+    def hsv(self):
+        if self._hsv is None:
+            self._hsv = cv2.cvtColor(self.raw, cv2.COLOR_BGR2HSV)
+        return self._hsv
+    # --------------------------------------------------------------------------------- 1 - Mask only blue
+    @property
+    def mask(self):
+        if self._mask is None:
+            self._mask = cv2.inRange(self.hsv, self.lower_blue, self.upper_blue)
+        return self._mask
+    # --------------------------------------------------------------------------------- 2 - Convert masked color to white. Rest to black
+    @property
+    def masked(self):
+        if self._masked is None:
+            self._masked = cv2.bitwise_and(self.raw, self.raw, mask=self.mask)
+        return self._masked
+    # --------------------------------------------------------------------------------- Frame of a region (numpy view; no copy)
+    def sub_frame(self, x0, y0, x1, y1):
+        return Frame(self.raw[y0:y1, x0:x1], self.lower_blue, self.upper_blue, self.timestamp, self.seq)
+    # --------------------------------------------------------------------------------- Frame of pyramid level n (1/2**n size)
+    def scaled(self, level):
+        if level <= 0:
+            return self
+        factor = 1.0 / (2 ** level)
+        small = cv2.resize(self.raw, None, fx=factor, fy=factor,
+                           interpolation=cv2.INTER_NEAREST)                           # nearest: cheapest; good enough for colour masks
+        return Frame(small, self.lower_blue, self.upper_blue, self.timestamp, self.seq)
+# -------------------------------------------------------------------------------------
+# Camera images of the bot as Frames, numbered and checked for age
+# -------------------------------------------------------------------------------------
+class FrameSource(object):
+    def __init__(self, bot, lower_blue, upper_blue, max_age=0.5, calibration=None):
+        self.bot = bot
+        self.lower_blue = lower_blue
+        self.upper_blue = upper_blue
+        self.calibration = calibration                                                # ColourCalibration; None: fixed ranges
+        self.max_age = max_age                                                        # seconds; 0 accepts any age
+        self.clock = getattr(bot, 'clock', time.time)                                 # same clock as the image timestamps
+        self.seq = 0
+        self.last_time = None
+        self.stale_count = 0
+    # ---------------------------------------------------------------------------------
+    # Returns: Frame of the latest camera image (any age); None if there is no image
+    # ---------------------------------------------------------------------------------
+    def grab(self, timeout=None):
+        if timeout is None:
+            image, image_time = self.bot.get_latest_camera_image()
+        else:
+            image, image_time = self.bot.get_latest_camera_image(timeout)
+        if image is None:
+            return None
+        if image_time != self.last_time:
+            self.seq += 1
+            self.last_time = image_time
+        lower_blue, upper_blue = self.lower_blue, self.upper_blue
+        if self.calibration is not None:
+            lower_blue, upper_blue = self.calibration.current()                       # picks up a recalibration
+        return Frame(image, lower_blue, upper_blue, image_time, self.seq)
+    def age(self, frame):
+        return self.clock() - frame.timestamp
+    # ---------------------------------------------------------------------------------
+    # Returns: Frame of the latest camera image; None if there is none or it is too old
+    # ---------------------------------------------------------------------------------
+    def latest(self):
+        frame = self.grab()
+        if frame is None:
+            return None
+        if self.max_age and self.age(frame) > self.max_age:
+            self.stale_count += 1
+            return None
+        return frame
+    # ---------------------------------------------------------------------------------
+    # Barrier: wait for the first frame captured after time 'after' (clock of the bot)
+    #
+    # Input: wait is called between polls (e.g. CommandScheduler.wait to keep sending commands)
+    # Returns: Frame; None after timeout seconds
+    # ---------------------------------------------------------------------------------
+    def wait_for_frame_after(self, after, timeout=2.0, poll=0.030, wait=time.sleep):
+        deadline = time.time() + timeout
+        while True:
+            frame = self.grab()
+            if frame is not None and frame.timestamp > after:
+                return frame
+            if time.time() >= deadline:
+                return None
+            wait(poll)
@@ -0,0 +1,70 @@
+#! /usr/bin/python
+
+#-----------------------------------------------------------------------------------------------------------------------------------------------------------
+# Coarse-to-fine marker search for reading_signs.py
+# - sweeps the neck in wide steps and looks for blue blobs on a downscaled frame (pyramid level)
+# - refines with small steps and full size frames only around a pan angle where a candidate blob showed up
+# - starts at the bearing where the marker was last seen, or straight ahead when a sign just pointed the robot
+#   in a new direction, and fans out from there
+#-----------------------------------------------------------------------------------------------------------------------------------------------------------
+import marker_tracking
+
+class SearchScheduler(object):
+    def __init__(self, min_pan=70.0, max_pan=110.0, coarse_step=10.0, fine_step=2.5,
+                 level=2, candidate_area=500, settle_time=0.038, settle_per_degree=0.002):
+        self.min_pan = min_pan                                                        # Limit swirling of neck
+        self.max_pan = max_pan
+        self.coarse_step = coarse_step
+        self.fine_step = fine_step
+        self.level = level                                                            # pyramid level of the coarse frames
+        self.candidate_area = candidate_area                                          # full size pixels of a candidate blob
+        self.settle_time = settle_time                                                # seconds after a fine step
+        self.settle_per_degree = settle_per_degree                                    # extra seconds per degree of neck travel
+        self.bearing = 90.0                                                           # pan angle to start the next search at
+    # --------------------------------------------------------------------------------- Bearing memory
+    def found(self, pan):
+        self.bearing = pan
+    def pointed(self, pan=90.0):                                                      # a sign turned the robot: look ahead first
+        self.bearing = pan
+    def clip(self, pan):
+        return min(self.max_pan, max(self.min_pan, pan))
+    # ---------------------------------------------------------------------------------
+    # Returns: coarse pan angles, fanning out from the remembered bearing
+    # ---------------------------------------------------------------------------------
+    def coarse_angles(self):
+        angles = [self.clip(self.bearing)]
+        offset = self.coarse_step
+        while True:
+            added = False
+            for pan in (self.bearing + offset, self.bearing - offset):
+                if self.min_pan <= pan <= self.max_pan:
+                    angles.append(pan)
+                    added = True
+            if not added:
+                break
+            offset += self.coarse_step
+        for pan in (self.min_pan, self.max_pan):                                      # the limits are always looked at
+            if pan not in angles and all(abs(pan - angle) > self.coarse_step / 2.0 for angle in angles):
+                angles.append(pan)
+        return angles
+    # ---------------------------------------------------------------------------------
+    # Returns: fine pan angles around a coarse candidate, nearest first
+    # ---------------------------------------------------------------------------------
+    def fine_angles(self, pan):
+        angles = [pan]
+        offset = self.fine_step
+        while offset <= self.coarse_step / 2.0:
+            for fine in (pan + offset, pan - offset):
+                if self.min_pan <= fine <= self.max_pan:
+                    angles.append(fine)
+            offset += self.fine_step
+        return angles
+    def settle(self, degrees):                                                        # seconds to wait after moving the neck
+        return self.settle_time + abs(degrees) * self.settle_per_degree
+    # ---------------------------------------------------------------------------------
+    # Input: Frame
+    # Returns: True when a blob big enough to be a (far) marker is in the downscaled frame
+    # ---------------------------------------------------------------------------------
+    def is_candidate(self, frame):
+        blobs = marker_tracking.detect_blobs(frame, level=self.level, min_area=self.candidate_area)
+        return len(blobs) > 0
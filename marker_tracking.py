@@ -0,0 +1,236 @@
+#! /usr/bin/python
+
+#-----------------------------------------------------------------------------------------------------------------------------------------------------------
+# Marker detection and ROI tracking for reading_signs.py
+# - MultiMarkerTracker only searches a padded region around the predicted box of the primary marker (it moves
+#   a few pixels per frame) and falls back to the full frame when the marker is lost or touches the ROI edge
+# - it extracts all blue blobs in one linear pass and keeps persistent IDs for several
+#   markers. A constant velocity Kalman filter per marker predicts position and width, so the controller
+#   can go on with a prediction when a frame is missing, late or a single frame is noisy
+#-----------------------------------------------------------------------------------------------------------------------------------------------------------
+import itertools
+import cv2
+import numpy as np
+import stage_timing
+from stage_timing import timer
+# -------------------------------------------------------------------------------------
+# All blue blobs in one linear pass (connected components; contours on OpenCV 2.4)
+#
+# Input: Frame, optional roi (x0, y0, x1, y1), pyramid level, minimum area in full size pixels
+# Returns: list of (x, y, w, h, area) in full frame coordinates, biggest first
+# -------------------------------------------------------------------------------------
+def detect_blobs(frame, roi=None, level=0, min_area=50):
+    x0, y0 = 0, 0
+    if roi is not None:
+        x0, y0, x1, y1 = roi
+        frame = frame.sub_frame(x0, y0, x1, y1)
+    start = stage_timing.clock()
+    frame = frame.scaled(level)
+    mask = frame.mask
+    timer.record('hsv_mask', start)
+    start = stage_timing.clock()
+    if hasattr(cv2, 'connectedComponentsWithStats'):
+        _, _, stats, _ = cv2.connectedComponentsWithStats(mask, connectivity=8)
+        boxes = [tuple(int(v) for v in row) for row in stats[1:]]                     # label 0 is the background
+    else:
+        contours, _ = cv2.findContours(mask.copy(), cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+        boxes = [cv2.boundingRect(cnt) + (int(cv2.contourArea(cnt)),) for cnt in contours]
+    timer.record('contours', start)
+    scale = 2 ** level
+    blobs = []
+    for x, y, w, h, area in boxes:
+        if area * scale * scale >= min_area:
+            blobs.append((x * scale + x0, y * scale + y0, w * scale, h * scale, area * scale * scale))
+    blobs.sort(key=lambda blob: blob[4], reverse=True)
+    return blobs
+# -------------------------------------------------------------------------------------
+# Constant velocity Kalman filter of one marker
+# State: centre x, centre y, width and their velocities (pixels, pixels per second)
+# -------------------------------------------------------------------------------------
+class MarkerTrack(object):
+    H = np.hstack((np.eye(3), np.zeros((3, 3))))
+    def __init__(self, track_id, blob, timestamp, accel_noise=300.0, measure_noise=4.0):
+        x, y, w, h, area = blob
+        self.id = track_id
+        self.state = np.array([x + w / 2.0, y + h / 2.0, float(w), 0.0, 0.0, 0.0])
+        self.covariance = np.diag([measure_noise ** 2] * 3 + [200.0 ** 2] * 3)
+        self.accel_noise = accel_noise
+        self.R = np.eye(3) * measure_noise ** 2
+        self.aspect = h / float(w)                                                    # height / width of the last measurement
+        self.timestamp = timestamp
+        self.last_seen = timestamp
+        self.hits = 1
+        self.misses = 0
+        self.blob = blob
+    def transition(self, dt):
+        F = np.eye(6)
+        F[0, 3] = F[1, 4] = F[2, 5] = dt
+        q = self.accel_noise ** 2
+        Q = np.zeros((6, 6))
+        for i in range(3):                                                            # white noise acceleration per axis
+            Q[i, i] = q * dt ** 4 / 4.0
+            Q[i, i + 3] = Q[i + 3, i] = q * dt ** 3 / 2.0
+            Q[i + 3, i + 3] = q * dt ** 2
+        return F, Q
+    def predict(self, timestamp):
+        dt = max(0.0, timestamp - self.timestamp)
+        if dt > 0.0:
+            F, Q = self.transition(dt)
+            self.state = F.dot(self.state)
+            self.covariance = F.dot(self.covariance).dot(F.T) + Q
+            self.timestamp = timestamp
+    def update(self, blob):
+        x, y, w, h, area = blob
+        z = np.array([x + w / 2.0, y + h / 2.0, float(w)])
+        S = self.H.dot(self.covariance).dot(self.H.T) + self.R
+        K = self.covariance.dot(self.H.T).dot(np.linalg.inv(S))
+        self.state = self.state + K.dot(z - self.H.dot(self.state))
+        self.covariance = (np.eye(6) - K.dot(self.H)).dot(self.covariance)
+        self.aspect = h / float(w)
+        self.last_seen = self.timestamp
+        self.hits += 1
+        self.misses = 0
+        self.blob = blob
+    # ---------------------------------------------------------------------------------
+    # Returns: x, y, w, h of the box at 'timestamp' (extrapolated; the track itself is not changed)
+    # ---------------------------------------------------------------------------------
+    def box(self, timestamp=None):
+        state = self.state
+        if timestamp is not None and timestamp > self.timestamp:
+            state = self.transition(timestamp - self.timestamp)[0].dot(state)
+        cx, cy, w = state[:3]
+        w = max(1.0, w)
+        h = w * self.aspect
+        return int(round(cx - w / 2.0)), int(round(cy - h / 2.0)), int(round(w)), int(round(h))
+# -------------------------------------------------------------------------------------
+# Several markers with persistent IDs; the primary one is the marker to steer to
+# -------------------------------------------------------------------------------------
+class MultiMarkerTracker(object):
+    def __init__(self, level=0, min_pad=24, pad_fraction=0.5, min_area=2000,
+                 max_tracks=4, max_misses=3, max_coast=1.0, min_gate=30):
+        self.level = level                                                            # pyramid level used inside the ROI
+        self.min_pad = min_pad                                                        # pixels around the box at least
+        self.pad_fraction = pad_fraction                                              # extra padding relative to the box size
+        self.min_area = min_area                                                      # smaller boxes are not trusted as marker
+        self.box = None
+        self.roi = None
+        self.roi_hits = 0
+        self.full_searches = 0
+        self.max_tracks = max_tracks                                                  # biggest blobs only; bounds the work per frame
+        self.max_misses = max_misses                                                  # frames a marker may be missing before it is dropped
+        self.max_coast = max_coast                                                    # seconds a marker outside the ROI is kept
+        self.min_gate = min_gate                                                      # pixels; association distance at least
+        self.ids = itertools.count(1)
+        self.tracks = []
+        self.primary_id = None
+        self.coasted = 0
+    def reset(self):                                                                  # neck or robot moved: positions are meaningless
+        self.box = None
+        self.roi = None
+        self.tracks = []
+        self.primary_id = None
+    def roi_around(self, box, shape):
+        x, y, w, h = box
+        pad = max(self.min_pad, int(self.pad_fraction * max(w, h)))
+        height, width = shape[:2]
+        return (max(0, x - pad), max(0, y - pad),
+                min(width, x + w + pad), min(height, y + h + pad))
+    # ---------------------------------------------------------------------------------
+    # True when the box reaches an ROI border that is not also the image border:
+    # the marker may continue outside the ROI
+    # ---------------------------------------------------------------------------------
+    def touches_edge(self, box, roi, shape):
+        x, y, w, h = box
+        x0, y0, x1, y1 = roi
+        height, width = shape[:2]
+        return ((x <= x0 and x0 > 0) or (y <= y0 and y0 > 0) or
+                (x + w >= x1 and x1 < width) or (y + h >= y1 and y1 < height))
+    def inside(self, track, roi):
+        if roi is None:
+            return True
+        x0, y0, x1, y1 = roi
+        cx, cy = track.state[:2]
+        return x0 <= cx < x1 and y0 <= cy < y1
+    def primary(self):
+        for track in self.tracks:
+            if track.id == self.primary_id:
+                return track
+        return None
+    # ---------------------------------------------------------------------------------
+    # Greedy nearest neighbour association of blobs and predicted tracks
+    # Tracks outside the searched roi are not counted as missing; they coast up to max_coast
+    # ---------------------------------------------------------------------------------
+    def associate(self, blobs, timestamp, roi=None):
+        for track in self.tracks:
+            track.predict(timestamp)
+        pairs = []
+        for t, track in enumerate(self.tracks):
+            cx, cy, w = track.state[:3]
+            gate = max(self.min_gate, w)
+            for b, (x, y, bw, bh, area) in enumerate(blobs):
+                distance = np.hypot(x + bw / 2.0 - cx, y + bh / 2.0 - cy)
+                if distance < gate:
+                    pairs.append((distance, t, b))
+        pairs.sort()
+        used_tracks = set()
+        used_blobs = set()
+        for distance, t, b in pairs:
+            if t in used_tracks or b in used_blobs:
+                continue
+            self.tracks[t].update(blobs[b])
+            used_tracks.add(t)
+            used_blobs.add(b)
+        for t, track in enumerate(self.tracks):
+            if t not in used_tracks and self.inside(track, roi):
+                track.misses += 1
+        self.tracks = [track for track in self.tracks
+                       if track.misses <= self.max_misses and timestamp - track.last_seen <= self.max_coast]
+        for b, blob in enumerate(blobs):
+            if b not in used_blobs and len(self.tracks) < self.max_tracks:
+                self.tracks.append(MarkerTrack(next(self.ids), blob, timestamp))
+        if self.primary() is None:                                                    # stick to the marker we steer to
+            candidates = [track for track in self.tracks if track.misses == 0]
+            if candidates:
+                self.primary_id = max(candidates, key=lambda track: track.state[2]).id
+            else:
+                self.primary_id = None
+    # ---------------------------------------------------------------------------------
+    # Input: Frame; use_roi=False forces a full frame search
+    # Returns: x, y, w, h, None of the primary marker (predicted while it is briefly missing);
+    #          None if there is no marker
+    # ---------------------------------------------------------------------------------
+    def find(self, frame, use_roi=True):
+        shape = frame.raw.shape
+        timestamp = frame.timestamp
+        track = self.primary()
+        blobs = None
+        if use_roi and track is not None:
+            roi = self.roi_around(track.box(timestamp), shape)
+            blobs = detect_blobs(frame, roi, self.level)[:self.max_tracks]
+            if (blobs and blobs[0][2] * blobs[0][3] > self.min_area and
+                    not self.touches_edge(blobs[0][:4], roi, shape)):
+                self.roi = roi
+                self.roi_hits += 1
+            else:
+                blobs = None
+        if blobs is None:
+            blobs = detect_blobs(frame)[:self.max_tracks]
+            self.roi = None
+            self.full_searches += 1
+        self.associate(blobs, timestamp, self.roi)
+        track = self.primary()
+        if track is None:
+            self.box = None
+            return None
+        if track.misses > 0:
+            self.coasted += 1
+        self.box = track.box()
+        return self.box + (None,)
+    # ---------------------------------------------------------------------------------
+    # Returns: x, y, w, h of the primary marker extrapolated to 'timestamp'; None if there is none
+    # ---------------------------------------------------------------------------------
+    def predict(self, timestamp):
+        track = self.primary()
+        if track is None:
+            return None
+        return track.box(timestamp)
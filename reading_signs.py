@@ -22,9 +22,10 @@
 # 
 # Light quality is essential for object detection by color. Upfront calibrating the inRange values is essential
 # This can be done by running calibrating_BGR_with_trackbars.py (can be imported as module when preferred)
+# The values can also be put in a calibration file (--calibration, see colour_calibration.py); it is reloaded while running
 # ToDo:
 #     - complete evasion routine when obstacles are detected
-#     - insert compass and encoder readings to log trajectory
+#     - insert compass readings to correct the encoder trajectory (--trajectory)
 #     - version with small camera images to run on the Raspberri Pi (without using websockets)
 #-----------------------------------------------------------------------------------------------------------------------------------------------------------
 import time
@@ -37,6 +38,20 @@ import py_websockets_bot.mini_driver
 import py_websockets_bot.robot_config
 import random
 import csv
+import sign_matching
+import sensor_cache
+import frame_cache
+import change_detection
+import colour_calibration
+import marker_tracking
+import vision_pipeline
+import marker_search
+import steering_controller
+import debug_view
+import command_scheduler
+import bot_recording
+import stage_timing
+from stage_timing import timer
 # -------------------------------------------------------------------------------------
 # Set and initialize variables
 # -------------------------------------------------------------------------------------
@@ -48,7 +63,6 @@ g_high = 255
 r_high = 255                                                                          # Low:  110,  50,  85
 lower_blue = np.array([b_low,g_low,r_low])                                            # High: 131, 119, 255
 upper_blue = np.array([b_high,g_high,r_high])                                         #
-font = cv2.FONT_HERSHEY_SIMPLEX
 next_action = 'START'
 marker_found = 0
 centroid_x = 0
@@ -58,14 +72,51 @@ h = 0
 area = 0
 min_pan_angle = 70.0                                                                  # Limit swirling of neck
 max_pan_angle = 110.0                                                                 #
-max_width = 404 * 0.6                                                                 # factor to stop in time due to buffer/performance
-max_range = 40                                                                        # Safety limit 
+max_range = 40                                                                        # Safety limit; stop range of the steering controller
 motor_speed = 40.0                                                                    # = 40%; corr. to PMW 44Hz
 next_action = 'START'                                                                 # 
-image = None
+camera = None                                                                         # FrameSource; numbered camera frames, stale ones refused
+frame = None                                                                          # Frame of the latest camera image (cached vision steps)
+vision = None                                                                         # VisionPipeline when running with --pipeline
+vision_result = None                                                                  # newest result of the vision worker (older frame)
+commands = None                                                                       # CommandScheduler; all motor and neck commands go through it
+steering = None                                                                       # SteeringController of MOVE_TO_MARKER
+sensors = None                                                                        # SensorCache; latest sensor snapshot and pose
+sensor_data = 24                                                                      # digital inputs; 24 = no IR sensor signal
+encoder_turns = False                                                                 # turn on encoder counts instead of time
+trajectory_path = None                                                                # CSV of the dead-reckoning pose
+turn_steps = {'RIGHT': 65, 'LEFT': 100, 'TURN': 170, 'SPIN': 34}                      # calibrated as time_out(steps): steps x sleep(1 ms)
+turn_times = {}                                                                       # seconds; measured or --turn-times
+debug = debug_view.DebugView( enabled=False )                                         # windows are drawn off-thread; headless by default
+marker_box = None                                                                     # (x, y, w, h) of the marker in frame; None when not found
+sign_denoise = 'bilateral'                                                            # denoiser of the sign extraction (sign_matching.denoisers)
+change_detector = change_detection.ChangeDetector()                                   # frames too similar to the last processed one are skipped
+sign_cache = None                                                                     # (frame, marker box, result) of the last filter_sign
+signs_reused = 0
+sign_reads = 3                                                                        # frames read while stopped in front of a sign
+coarse_views = {}                                                                     # coarse angle: [ChangeDetector, candidate]
+coarse_reuse = 60.0                                                                   # seconds a coarse answer may be reused; sweeps take a while
+candidates_reused = 0
 #-------------------------------------------------------------------------------------- grab camera image and track blue
-def find_marker():
-    global centroid_x, centroid_y, w, h, camera_range, marker_found, image
+def find_marker(tracking=False):                                                      # tracking: search around the last marker only
+    global centroid_x, centroid_y, w, h, camera_range, marker_found, frame, marker_box, vision_result
+    start = stage_timing.clock()
+    new_frame = camera.latest()
+    timer.record('frame_fetch', start)
+    if new_frame is None:                                                             # no image or too old; keep the last result
+        predicted = marker_tracker.predict(camera.clock())                            # or its prediction while tracking
+        if tracking and predicted is not None:
+            x,y,w,h = predicted
+            centroid_x = x + (w/2)
+            centroid_y = y + (h/2)
+            camera_range = round((16175.288 / w),0)
+        return
+    start = stage_timing.clock()
+    changed = change_detector.changed(new_frame, same_seq_only=tracking)              # tracking: only the same image is skipped
+    timer.record('change_detect', start)
+    if not changed:                                                                   # nothing new in view; keep the last result
+        return
+    frame = new_frame                                                                 # 0..2 - HSV, blue mask, masked; computed once per frame
     marker_found = 0
     centroid_x = 0
     centroid_y = 0
@@ -73,100 +124,96 @@ def find_marker():
     h = 0
     area = 0
     camera_range = 0
-    image, _  = bot.get_latest_camera_image()
-    hsv = cv2.cvtColor(image, cv2.COLOR_BGR2HSV)                                      # 0 - Set color space
-    mask_image = cv2.inRange(hsv, lower_blue, upper_blue)                             # 1 - Mask only blue
-    result_image = cv2.bitwise_and(image,image, mask= mask_image)                     # 2 - Convert masked color to white. Rest to black 
-    result_image = cv2.cvtColor(result_image, cv2.COLOR_BGR2GRAY )                    # 3 - Convert to Gray (needed for binarizing)
-    contours, _ = cv2.findContours(result_image,
-                                   cv2.RETR_LIST,
-                                   cv2.CHAIN_APPROX_SIMPLE)                           # 4 - Find contours of all shapes
-    contours = sorted(contours, key=cv2.contourArea, reverse=True) [:1]               # 5 - Select biggest; drop the rest
-    if len (contours) > 0:
-        cnt = contours[0]
-        x,y,w,h = cv2.boundingRect(cnt)
+    marker_box = None
+    if tracking and vision is not None:                                               # 4..5 - done by the vision worker; take newest result
+        vision.submit(frame.raw, frame.timestamp)
+        result = vision.latest()
+        found = None
+        if result is not None and result[2] is not None:
+            found = result[2] + (None,)
+            vision_result = result
+    else:
+        found = marker_tracker.find(frame, use_roi=tracking)                          # 4..5 - Tracked blobs; in ROI or full frame
+    if found is not None:
+        x,y,w,h,cnt = found
+        marker_box = (x,y,w,h)
         centroid_x = x + (w/2)
         centroid_y = y + (h/2)
         camera_range = round((16175.288 / w),0)                                       # real width * focal length = 16175.288
-        cv2.drawContours(image, [cnt], -1, (0, 0, 255), 2)                            # Not needed; Just to display the differance
-        cv2.rectangle(image,(x,y),(x+w,y+h),(0,255,0),2)
-        heads_up_display()
-        cv2.imshow( "searching", image )
-        cv2.waitKey(1)
+        if debug.enabled:                                                             # Not needed; Just to display the differance
+            annotations = [('rect', (x,y), (x+w,y+h), (0,255,0), 2)]
+            if cnt is not None:
+                annotations.append(('contour', cnt, (0, 0, 255), 2))
+            if marker_tracker.roi is not None:
+                x0,y0,x1,y1 = marker_tracker.roi
+                annotations.append(('rect', (x0,y0), (x1,y1), (255,255,0), 1))
+            for track in marker_tracker.tracks:                                       # other markers and their IDs
+                tx,ty,tw,th = track.box()
+                annotations.append(('text', '%d' % track.id, (tx, ty - 4), (255,255,0), 0.5, 1))
+            debug.show( "searching", frame.raw, annotations + heads_up_display() )
         area = w * h
         if area > 2000:
             marker_found = 1
-#-------------------------------------------------------------------------------------- Timer routine for accuracy
+#-------------------------------------------------------------------------------------- Timer routine; one sleep, no drift of 1 ms steps
 def time_out (milsec):
-    for i in xrange (milsec):
-        time.sleep (0.001)
+    time.sleep (milsec / 1000.0)
 #-------------------------------------------------------------------------------------- Display coordinates and range in window
 def heads_up_display ():
     central = 'centre  %d : %d ' % (centroid_x, centroid_y)
     distance = 'range   %d ' % (camera_range)
-    cv2.putText(image, central,(20, 25), font, 0.5,(0,255,0),2)
-    cv2.putText(image, distance,(20, 45), font, 0.5,(0,255,0),2)
+    return [('text', central, (20, 25), (0,255,0), 0.5, 2),
+            ('text', distance, (20, 45), (0,255,0), 0.5, 2)]
 # -------------------------------------------------------------------------------------  
-def read_sensors ():
+def read_sensors ():                                                                  # latest snapshot of the sensor cache; no round trip
     global sensor_data
-    status_dict, _ = bot.get_robot_status_dict()
-    sensor_dict = status_dict[ "sensors" ]
-    sensor_data = sensor_dict[ "digital" ][ "data" ]
+    start = stage_timing.clock()
+    snapshot = sensors.latest()
+    if snapshot.digital is not None:
+        sensor_data = snapshot.digital
+    timer.record('sensor_read', start)
+#-------------------------------------------------------------------------------------- Seconds the old time_out(steps) really took on this machine
+def legacy_turn_times (samples=50):                                                   # a 1 ms sleep lasts longer (Windows: up to 15.6 ms)
+    start = command_scheduler.monotonic()
+    for i in xrange(samples):
+        time.sleep (0.001)
+    step = (command_scheduler.monotonic() - start) / samples
+    return dict((name, steps * step) for name, steps in turn_steps.items())
+#-------------------------------------------------------------------------------------- Turn on the spot; on encoder counts or for a calibrated time
+def turn (left, right, duration, degrees):
+    if encoder_turns and sensors.turn( commands, left, right, degrees, timeout=3 * duration + 0.5 ) is not None:
+        return
+    commands.timed_action( left, right, duration )
 # -------------------------------------------------------------------------------------  
-# Filter inner sign area 
+# Filter inner sign area; only in a padded crop of the marker box when there is one
 #
-# Returns: smallest contour
+# Returns: 1 when a sign is found, all candidate rectangles (smallest first)
 # -------------------------------------------------------------------------------------
 def filter_sign():
-    bot.update()
-    sign_filtered = 0
-    area_save = 0.0
+    global sign_cache, signs_reused
+    commands.update()
     print 'Filtering sign area .................'
-    hsv = cv2.cvtColor(image, cv2.COLOR_BGR2HSV)                                      # 0 - Set color range to search for blue shapes
-    mask_image = cv2.inRange(hsv, lower_blue, upper_blue)                             # 1 - Mask only blue
-    result_image = cv2.bitwise_and(image,image, mask= mask_image)                     # 2 - Convert masked color to white. Rest to black 
-    result_image = cv2.bilateralFilter(result_image,9,75,75)                          # 3 - Optional: Blurring the result to de-noise
-    result_image = cv2.cvtColor(result_image, cv2.COLOR_BGR2GRAY )                    # 4 - Convert to Gray (needed for binarizing)
-    result_image = cv2.Canny(result_image,threshold1=90, threshold2=190)              # 5 - Find edges of all shapes
-    contours, _ = cv2.findContours(result_image,
-                                   cv2.RETR_LIST,
-                                   cv2.CHAIN_APPROX_SIMPLE)                           # 6 - Find contours of all shapes
-    contours = sorted(contours, key=cv2.contourArea, reverse=True) [:4]               # 7 - Select biggest 4; drop the rest
-    contour_save = None
-    objects_found = len(contours)
-    if objects_found >= 1:               
-        loop_count = 0
-        loop_count = int(loop_count)
-        rectangle_count = 0
-        while loop_count < objects_found:
-            cnt = contours[loop_count]
-            M = cv2.moments(cnt)
-            area = cv2.contourArea(cnt)
-            epsilon = 0.1*cv2.arcLength(cnt,True)                                     
-            approx = cv2.approxPolyDP(cnt,epsilon,True)
-            if len (approx) == 4:
-                if area > 5000:
-                    if loop_count == 0:                                               # 8 - Keep the smallest aledged rectangle
-                        rectangle_count += 1
-                        contour_save = approx
-                        area_save = area
-                    elif area < area_save:
-                        rectangle_count += 1
-                        contour_save = approx
-            loop_count += 1
-        if rectangle_count > 0:
-            sign_filtered = 1
-    return sign_filtered, contour_save
+    if sign_cache is not None and sign_cache[0] is frame and sign_cache[1] == marker_box:
+        signs_reused += 1                                                             # find_marker skipped the frames since
+        return sign_cache[2]
+    start = stage_timing.clock()
+    roi = None
+    if marker_box is not None:                                                        # only around the marker just found
+        roi = sign_matching.sign_roi(marker_box, frame.raw.shape)
+    quads = sign_matching.extract_quads(frame, roi, sign_denoise)
+    timer.record('sign_filter', start)
+    sign_filtered = 0
+    if len(quads) > 0:
+        sign_filtered = 1
+    sign_cache = (frame, marker_box, (sign_filtered, quads))
+    return sign_filtered, quads
 # -------------------------------------------------------------------------------------
-# Match images: crop, warp and intensivy the sign area and compare images
+# Crop, warp and intensivy the sign area
 #
-# Returns: next action
+# Returns: binary sign image of template size
 # -------------------------------------------------------------------------------------
-def compare_images(contour_save):
-    bot.update()
-    print 'Comparing images .................... '
-    signRight, signLeft, signTurn, signStop = get_reference_images()                   # read reference files
-    contour_points = contour_save.reshape(4, 2)                                                      
+def warp_sign(contour_save):
+    start = stage_timing.clock()
+    contour_points = contour_save.reshape(4, 2)
     points_sorted = np.zeros((4, 2), dtype = "float32")                                # initializing output window in same order
     sum_of_points = contour_points.sum(axis = 1)                                       # determine top-left, top-right, bottom-right, bottom-left
     points_sorted[0] = contour_points[np.argmin(sum_of_points)]
@@ -185,69 +232,42 @@ def compare_images(contour_save):
                             [maxWidth - 2, maxHeight - 2],
                             [0, maxHeight - 2]],dtype = "float32")
     M = cv2.getPerspectiveTransform(points_sorted, destination)
-    warped_image = cv2.warpPerspective(image, M, (maxWidth, maxHeight))
-    cv2.drawContours(image, [contour_save], -1, (255, 0, 0), 2)
-    cv2.imshow("Cnt Found", image)
-    cv2.waitKey(1)
+    warped_image = cv2.warpPerspective(frame.raw, M, (maxWidth, maxHeight))           # warp the clean pixels; not the annotated copy
     warped_image = cv2.cvtColor(warped_image, cv2.COLOR_BGR2GRAY)                      # convert to gray, blur and threshold
-    warped_image = cv2.GaussianBlur(warped_image,(5,5),0)
-    thrh,warped_image = cv2.threshold(warped_image,0,255,
-                                      cv2.THRESH_BINARY+cv2.THRESH_OTSU)
-    (hc, wc) = signRight.shape[:2]                                                     # equalize shapes
+    warped_image = sign_matching.preprocess_sign(warped_image)
+    (hc, wc) = sign_templates.shape                                                    # equalize shapes
     resized = cv2.resize(warped_image, (wc,hc),
                          interpolation=cv2.INTER_AREA)
-    cv2.imshow ('resized', resized)
-    cv2.waitKey(1)
-    output=signRight                                                                   # create window for bitwise output
-    print 'Mean Squared Error comparing ........'
-    mse_v = mse(resized,signRight)
-    if mse_v > 5000:
-        mse_v = mse(resized,signLeft)
-        if mse_v > 5000:
-            mse_v = mse(resized,signTurn)
-            if mse_v > 5000:
-                mse_v = mse(resized,signStop)
-                if mse_v > 5000:
-                    next_action = 'NO MATCH'
-                else:
-                    next_action = 'STOP'
-            else:
-                next_action = 'TURN'
-        else:
-            next_action = 'LEFT'
-    else:
-        next_action = 'RIGHT'
-    return next_action
+    timer.record('warp', start)
+    return resized
 # -------------------------------------------------------------------------------------
-# Read the reference files from disk Blurring and thresholding to assure the pictures
-# corrolate in values with the printed sign  
+# Match images: every candidate rectangle is warped and compared; the best match wins
 #
-# Returns: images read 
-# -------------------------------------------------------------------------------------    
-def get_reference_images():
-    print 'Reading reference images ............'
-    signRight = cv2.imread('signright.jpg',0)
-    if signRight != None:
-        signRight = cv2.GaussianBlur(signRight,(5,5),0)
-        _,signRight = cv2.threshold(signRight,0,255,cv2.THRESH_BINARY+cv2.THRESH_OTSU)
-        signLeft = cv2.imread('signleft.jpg',0)
-        if signLeft != None:
-            signLeft = cv2.GaussianBlur(signLeft,(5,5),0)
-            _,signLeft = cv2.threshold(signLeft,0,255,cv2.THRESH_BINARY+cv2.THRESH_OTSU)
-            signTurn = cv2.imread('signturn.jpg',0)
-            if signTurn != None:
-                signTurn = cv2.GaussianBlur(signTurn,(5,5),0)
-                _,signTurn = cv2.threshold(signTurn,0,255,cv2.THRESH_BINARY+cv2.THRESH_OTSU)
-                signStop = cv2.imread('signstop.jpg',0)
-                if signStop != None:
-                    signStop = cv2.GaussianBlur(signStop,(5,5),0)
-                    _,signStop = cv2.threshold(signStop,0,255,cv2.THRESH_BINARY+cv2.THRESH_OTSU)
-    else:
-        print 'Error(s) reading files !!!'
-        wait = raw_input()
-    return signRight, signLeft, signTurn, signStop
+# Returns: next action
+# -------------------------------------------------------------------------------------
+def compare_images(quads):
+    commands.update()
+    print 'Comparing images .................... '
+    best = (sign_matching.NO_MATCH, float('inf'), 0.0)
+    best_quad = quads[0]
+    best_image = None
+    for quad in quads:
+        resized = warp_sign(quad)
+        start = stage_timing.clock()
+        match = sign_templates.match(resized)                                          # all templates in one go
+        timer.record('matching', start)
+        if best_image is None or match[1] < best[1]:
+            best, best_quad, best_image = match, quad, resized
+    next_action, mse_v, margin = best
+    debug.show("Cnt Found", frame.raw, [('contour', best_quad, (255, 0, 0), 2)])
+    debug.show('resized', best_image)
+    print 'Mean Squared Error comparing ........'
+    if margin is not None:
+        margin = '%.0f' % margin
+    print 'sign / mse / margin / candidates = %s / %.0f / %s / %d ' % (next_action, mse_v, margin, len(quads))
+    return next_action
 # -------------------------------------------------------------------------------------
-# Compare 2 images Both routines can be used (current use: MSE)
+# Compare 2 images by their differing pixels (alternative to the MSE of sign_matching.SignTemplates)
 #
 # Input: image from disk, image found on sign
 # Returns: number of non-zero pixels
@@ -258,163 +278,345 @@ def bwc(imageA, imageB):
     #cv2.imshow('output',output)                                                       # (un)comment to hide/watch output images one by one
     #cv2.waitKey(0)
     return diff
-def mse(imageA, imageB):                                                               # Mean Squared Error = differance in pixel intensity 
-    err = np.sum((imageA.astype("float") - imageB.astype("float")) ** 2)
-    err /= float(imageA.shape[0] * imageA.shape[1])
-    return err
-#--------------------------------------------------------------------------------------- Set up a parser for command line arguments
-parser = argparse.ArgumentParser( "Gets images from the robot" )
-parser.add_argument( "hostname", default="localhost", nargs='?',
-                     help="The ip address of the robot" )
-args = parser.parse_args()
-# -------------------------------------------------------------------------------------- Connect to the robot
-#bot = py_websockets_bot.WebsocketsBot( args.hostname )
-bot = py_websockets_bot.WebsocketsBot( "192.168.42.1" )
-#--------------------------------------------------------------------------------------- Initialize mini driver pins       
-sensorConfiguration = py_websockets_bot.mini_driver.SensorConfiguration(
-    configD12=py_websockets_bot.mini_driver.PIN_FUNC_ULTRASONIC_READ,                  # SeeeD 3-pin Ultrasonic sensor
-    configD13=py_websockets_bot.mini_driver.PIN_FUNC_INACTIVE, 
-    configA0=py_websockets_bot.mini_driver.PIN_FUNC_ANALOG_READ, 
-    configA1=py_websockets_bot.mini_driver.PIN_FUNC_DIGITAL_READ,                      # Sharp IR switch RIGHT
-    configA2=py_websockets_bot.mini_driver.PIN_FUNC_DIGITAL_READ,                      # Sharp IR switch LEFT
-    configA3=py_websockets_bot.mini_driver.PIN_FUNC_DIGITAL_READ,                      # Grove Line sensor RIGHT
-    configA4=py_websockets_bot.mini_driver.PIN_FUNC_DIGITAL_READ,                      # Grove Line sensor MIDDLE
-    configA5=py_websockets_bot.mini_driver.PIN_FUNC_DIGITAL_READ,                      # Grove Line sensor LEFT
-    leftEncoderType=py_websockets_bot.mini_driver.ENCODER_TYPE_SINGLE_OUTPUT,          # Single encoder
-    rightEncoderType=py_websockets_bot.mini_driver.ENCODER_TYPE_SINGLE_OUTPUT )        # Single encoder
-robot_config = bot.get_robot_config()
-robot_config.miniDriverSensorConfiguration = sensorConfiguration
-bot.set_robot_config( robot_config )
-bot.update()                                                                           # Update any background communications with the robot
-time_out (100)                                                                         # Sleep to avoid overload of the web server on the robot
-#--------------------------------------------------------------------------------------
-if __name__ == "__main__":
+#--------------------------------------------------------------------------------------- Connect to the robot and initialize mini driver pins
+def connect_robot(hostname):
+    bot = py_websockets_bot.WebsocketsBot( hostname )
+    sensorConfiguration = py_websockets_bot.mini_driver.SensorConfiguration(
+        configD12=py_websockets_bot.mini_driver.PIN_FUNC_ULTRASONIC_READ,              # SeeeD 3-pin Ultrasonic sensor
+        configD13=py_websockets_bot.mini_driver.PIN_FUNC_INACTIVE, 
+        configA0=py_websockets_bot.mini_driver.PIN_FUNC_ANALOG_READ, 
+        configA1=py_websockets_bot.mini_driver.PIN_FUNC_DIGITAL_READ,                  # Sharp IR switch RIGHT
+        configA2=py_websockets_bot.mini_driver.PIN_FUNC_DIGITAL_READ,                  # Sharp IR switch LEFT
+        configA3=py_websockets_bot.mini_driver.PIN_FUNC_DIGITAL_READ,                  # Grove Line sensor RIGHT
+        configA4=py_websockets_bot.mini_driver.PIN_FUNC_DIGITAL_READ,                  # Grove Line sensor MIDDLE
+        configA5=py_websockets_bot.mini_driver.PIN_FUNC_DIGITAL_READ,                  # Grove Line sensor LEFT
+        leftEncoderType=py_websockets_bot.mini_driver.ENCODER_TYPE_SINGLE_OUTPUT,      # Single encoder
+        rightEncoderType=py_websockets_bot.mini_driver.ENCODER_TYPE_SINGLE_OUTPUT )    # Single encoder
+    robot_config = bot.get_robot_config()
+    robot_config.miniDriverSensorConfiguration = sensorConfiguration
+    bot.set_robot_config( robot_config )
+    bot.update()                                                                       # Update any background communications with the robot
+    time_out (100)                                                                     # Sleep to avoid overload of the web server on the robot
+    return bot
+#--------------------------------------------------------------------------------------- Point the neck and wait for a frame taken after it settled
+def point_neck(pan_angle, tilt_angle, from_angle):
+    commands.set_neck_angles( pan_angle,tilt_angle)
+    marker_tracker.reset()                                                            # neck moved; tracks are meaningless
+    change_detector.reset()
+    commands.wait (search_scheduler.settle(pan_angle - from_angle))
+    return camera.wait_for_frame_after( camera.clock(), wait=commands.wait )
+#--------------------------------------------------------------------------------------- Coarse check; an unchanged view at the same angle gets the answer of the last sweep
+def is_candidate(frame, angle):
+    global candidates_reused
+    view = coarse_views.get(angle)
+    if view is None:
+        view = [change_detection.ChangeDetector( threshold=change_detector.threshold, max_reuse=coarse_reuse ), False]
+        coarse_views[angle] = view
+    start = stage_timing.clock()
+    changed = view[0].changed(frame)
+    timer.record('change_detect', start)
+    if changed:
+        view[1] = search_scheduler.is_candidate(frame)
+    else:
+        candidates_reused += 1
+    return view[1]
+#--------------------------------------------------------------------------------------- Search marker: wide steps on small frames; fine steps around candidates
+def search_marker(tilt_angle):
+    global motor_speed
+    neck_angle = 90.0
+    sweeps = 0
+    while True:
+        angles = search_scheduler.coarse_angles()
+        frame_coarse = point_neck( angles[0], tilt_angle, neck_angle )
+        neck_angle = angles[0]
+        for i in range(len(angles)):
+            coarse_angle = angles[i]
+            commands.update()
+            moved = None
+            if i + 1 < len(angles):                                                   # move on while this frame is processed
+                commands.set_neck_angles( angles[i + 1],tilt_angle)
+                moved = command_scheduler.monotonic()
+                neck_angle = angles[i + 1]
+            if frame_coarse is not None and is_candidate(frame_coarse, coarse_angle):
+                for fine_angle in search_scheduler.fine_angles(coarse_angle):
+                    point_neck( fine_angle, tilt_angle, neck_angle )
+                    neck_angle = fine_angle
+                    find_marker()
+                    timer.end_iteration()
+                    if marker_found == 1:
+                        search_scheduler.found(fine_angle)
+                        return fine_angle
+                coarse_views[coarse_angle][1] = False                                 # no marker here until the view changes
+            timer.end_iteration()
+            if moved is not None:
+                if neck_angle != angles[i + 1]:                                       # refinement moved the neck away
+                    frame_coarse = point_neck( angles[i + 1], tilt_angle, neck_angle )
+                    neck_angle = angles[i + 1]
+                else:
+                    marker_tracker.reset()
+                    change_detector.reset()
+                    commands.wait_until(moved + search_scheduler.settle(angles[i + 1] - coarse_angle))
+                    frame_coarse = camera.wait_for_frame_after( camera.clock(), wait=commands.wait )
+        sweeps += 1
+        if sweeps > 1:                                                                # nothing in two sweeps: spin
+            motor_speed = 70.0
+            commands.timed_action( -motor_speed, motor_speed, turn_times['SPIN'] )
+            camera.wait_for_frame_after( camera.clock(), wait=commands.wait )         # no frames from before the spin
+            motor_speed = 40.0
+            sweeps = 0
+#--------------------------------------------------------------------------------------- Read the sign while stopped in front of it; a few frames until one matches
+#
+# Returns: the sign read (or NO_MATCH); None when no sign area was found at all
+# -------------------------------------------------------------------------------------
+def read_sign():
+    action = None
+    for attempt in xrange(sign_reads):
+        if attempt > 0:
+            commands.wait (0.200)
+            find_marker()                                                             # skipped while the view does not change
+        reused = signs_reused
+        sign_filtered, quads = filter_sign()
+        if attempt > 0 and signs_reused > reused:                                     # same view; same answer as the last read
+            continue
+        if sign_filtered == 1:
+            action = compare_images(quads)
+            if action != sign_matching.NO_MATCH:
+                break
+    return action
+#--------------------------------------------------------------------------------------- Find marker, move to marker, read sign and act on it
+def main_loop():
+    global next_action, marker_found, motor_speed, vision_result
     #---------------------------------------------------------------------------------- Start streaming images from the camera
     bot.start_streaming_camera_images()
     time_out (200)
     #----------------------------------------------------------------------------------    
     while next_action != 'STOP':
         marker_found == 0
-        bot.update()
+        commands.update()
         tilt_angle = 90
-        pan_angle = 90
-        bot.set_neck_angles( pan_angle,tilt_angle)
-        time_out (20)
-        find_marker()       
         # -----------------------------------------------------------------------------
         # FIND MARKER (until blue object found)
         # -----------------------------------------------------------------------------
-        shuffle = 0
-        while marker_found == 0:
-            if shuffle > 1:
-                motor_speed = 70.0
-                bot.set_motor_speeds( -motor_speed, motor_speed )
-                time_out (34)
-                bot.set_motor_speeds (0.0 , 0.0)
-                motor_speed = 40.0
-                shuffle = 0
-            bot.update()
-            if pan_angle < max_pan_angle:
-               pan_angle += 2.5
-            else:
-                pan_angle = min_pan_angle
-                marker_found = 0
-                shuffle += 1 
-            bot.set_neck_angles( pan_angle,tilt_angle)
-            time_out (38)
-            find_marker()
+        search_start = time.time()
+        pan_angle = search_marker( tilt_angle )
         print'pan angle                            =', pan_angle
+        print'search time                          = %.2f s' % (time.time() - search_start)
         # -----------------------------------------------------------------------------
         # MOVE_TO_MARKER (until <= 40 cm)
         # -----------------------------------------------------------------------------
         list_width = []
         list_speed = []
         pan_angle = 90
-        speed_adjust = 0.0
-        w_save = w - 1
-        bot.set_neck_angles( pan_angle,tilt_angle)
+        commands.set_neck_angles( pan_angle,tilt_angle)
+        marker_tracker.reset()                                                        # neck moved; next search is full frame
+        change_detector.reset()
+        if vision is not None:
+            vision.reset()
+            vision_result = None
+        observed_seq = None
+        steering.start()                                                              # steers at its own rate from here
         read_sensors()
-        while w < max_width:
+        while not steering.arrived and not steering.lost and steering.alive():
             if sensor_data != 24:                                                     # Test for any IR sensor signal
-               bot.set_motor_speeds( 0.0, 0.0 )
+               steering.stop()
+               commands.set_motor_speeds( 0.0, 0.0 )
                print 'Obstacle detected!', sensor_data
                break
             list_width.append (w)
-            if w > w_save:
-                speed_adjust = 1.1 *(((centroid_x - 320) / 640.000) * 50)
-                speed_adjust = round (speed_adjust, 1)
-                motor_l = motor_speed + speed_adjust
-                motor_r = motor_speed - speed_adjust
-                list_speed.append (w)
-                w_save = w
-                bot.set_motor_speeds( motor_l, motor_r )
-            bot.update()
-            time_out (10)                                                             # Need delays to avoid overload of webserver !
+            commands.update()
             read_sensors()
-            time_out(10)
-            find_marker()
-            time_out (16)                                                             # Need delays to avoid overload of camera buffer !
-        bot.set_motor_speeds (0.0, 0.0)
-        time_out (1)
+            find_marker(tracking=True)
+            track = marker_tracker.primary()
+            if vision is not None:                                                    # Kalman estimate of the vision worker
+                result = vision_result
+                if result is not None and result[3] is not None and result[0] != observed_seq:
+                    observed_seq = result[0]                                          # every worker result once
+                    track_id, cx, tw, vx, vw = result[3]
+                    steering.observe( result[1], cx, tw, vx, vw )                     # capture time of the frame it is based on
+            elif track is not None:                                                   # Kalman estimate incl. velocities
+                cx, cy, tw, vx, vy, vw = track.state
+                steering.observe( track.timestamp, cx, tw, vx, vw )
+            elif marker_found == 1:
+                steering.observe( frame.timestamp, centroid_x, w )
+            list_speed.append (steering.speed_adjust)
+            commands.wait (0.016)                                                     # Need delays to avoid overload of camera buffer !
+            timer.end_iteration()
+        lost = not steering.arrived and (steering.lost or steering.error is not None)
+        steering.stop()
+        commands.set_motor_speeds (0.0, 0.0)
+        commands.flush()
         print'found  =',list_width, len(list_width), 'times'
         print'speeds =',list_speed, len(list_speed), 'times'
-        print'width / range / speed = %d / %d / %d ' % (w, camera_range, speed_adjust)
+        print'width / range / speed = %d / %d / %d ' % (w, steering.range, steering.speed_adjust)
+        print'roi hits / full searches / coasted = %d / %d / %d ' % (marker_tracker.roi_hits, marker_tracker.full_searches,
+                                                                     marker_tracker.coasted)
+        if lost:                                                                      # marker lost or steering failed; search again
+            print 'Marker lost; searching again ........'
+            continue
         # -----------------------------------------------------------------------------
         # READ SIGN (until match) and ACT_ON_SIGN (next action or stop)
         # -----------------------------------------------------------------------------
-        sign_filtered, contour_save = filter_sign()
-        if sign_filtered == 1:
-            next_action = compare_images(contour_save)
-        else:
-            time_out (200)
-        bot.update()
+        action = read_sign()
+        if action is not None:
+            next_action = action
+        commands.update()
         motor_speed = 70.0
-        bot.set_motor_speeds( 0.0, 0.0 )
+        commands.set_motor_speeds( 0.0, 0.0 )
+        commands.flush()
         if next_action == 'STOP':
             print 'STOP'
             wait = raw_input()
             pass
         if next_action == 'RIGHT':
             print 'RIGHT'
-            bot.set_motor_speeds( motor_speed, -motor_speed )
-            time_out (65)
-            bot.set_motor_speeds( 0.0, 0.0 )
+            turn( motor_speed, -motor_speed, turn_times['RIGHT'], 90 )
             next_action = 'START'
-             bot.update ()
-            image = None                                                              # Routine to avoid using images in camera buffer
-            while image == None:
-                image, _  = bot.get_latest_camera_image(1.0)                          # Force latest image (= new sign)
-                time_out (30)
+            search_scheduler.pointed()                                                # sign pointed us; look ahead first
+            commands.update ()
+            camera.wait_for_frame_after( camera.clock(), wait=commands.wait )         # Skip images in camera buffer (= new sign)
         if next_action == 'LEFT':
             print 'LEFT'
-            bot.set_motor_speeds( -motor_speed, motor_speed )
-            time_out (100)
-            bot.set_motor_speeds( 0.0, 0.0 )
+            turn( -motor_speed, motor_speed, turn_times['LEFT'], 90 )
             next_action = 'START'
-            bot.update ()
-            image = None                                                              # Routine to avoid using images in camera buffer
-            while image == None:
-                image, _  = bot.get_latest_camera_image(1.0)                          # Force latest image (= new sign)
-                time_out (30)
+            search_scheduler.pointed()                                                # sign pointed us; look ahead first
+            commands.update ()
+            camera.wait_for_frame_after( camera.clock(), wait=commands.wait )         # Skip images in camera buffer (= new sign)
         if next_action == 'TURN':
             print 'TURN'
-            bot.set_motor_speeds( motor_speed, -motor_speed )
-            time_out (170)
-            bot.set_motor_speeds( 0.0, 0.0 )
+            turn( motor_speed, -motor_speed, turn_times['TURN'], 180 )
             next_action = 'START'
-            bot.update ()
-            image = None                                                              # Routine to avoid using images in camera buffer
-            while image == None:
-                image, _  = bot.get_latest_camera_image(1.0)                          # Force latest image (= new sign)
-                time_out (30)
+            search_scheduler.pointed()                                                # sign pointed us; look ahead first
+            commands.update ()
+            camera.wait_for_frame_after( camera.clock(), wait=commands.wait )         # Skip images in camera buffer (= new sign)
         if next_action == 'NO MATCH':
             print 'NO MATCH'
         motor_speed = 40.0
+        snapshot = sensors.snapshot
+        if snapshot is not None:
+            print'pose x / y / heading = %.1f cm / %.1f cm / %.0f deg ' % (snapshot.x, snapshot.y,
+                                                                         math.degrees(snapshot.heading))
         #cv2.destroyAllWindows()
-    # --------------------------------------------------------------------------------- Finalize    
-    cv2.destroyAllWindows()
+#--------------------------------------------------------------------------------------- Finalize; also after an error or Ctrl-C
+def finalize():
+    debug.close()
+    if steering is not None:
+        steering.stop()
+    if vision is not None:
+        vision.close()
+    if sensors is not None:
+        sensors.stop()
+        print 'Sensor polls / blocking reads .......', sensors.polls, sensors.blocking_reads
+        if trajectory_path:
+            sensors.write_trajectory( trajectory_path )
     bot.stop_streaming_camera_images()
     bot.set_motor_speeds( 0.0, 0.0 )
     bot.centre_neck()
+    timer.report()
+    timer.close()
+    if camera is not None:
+        print 'Stale frames refused ................', camera.stale_count
+    print 'Frames processed / skipped ..........', change_detector.processed, change_detector.skipped
+    print 'Coarse views reused .................', candidates_reused
+    print 'Sign areas reused ...................', signs_reused
     print 'FINISHED'
     bot.disconnect()
+#--------------------------------------------------------------------------------------
+if __name__ == "__main__":
+    #---------------------------------------------------------------------------------- Set up a parser for command line arguments
+    parser = argparse.ArgumentParser( "Gets images from the robot" )
+    parser.add_argument( "hostname", default="localhost", nargs='?',
+                         help="The ip address of the robot" )
+    parser.add_argument( "--roi-level", type=int, default=0,
+                         help="Pyramid level used when tracking the marker in a ROI (0 = full size)" )
+    parser.add_argument( "--search-level", type=int, default=2,
+                         help="Pyramid level of the frames of the coarse marker search" )
+    parser.add_argument( "--signs", default=".",
+                         help="Directory with the reference sign images (sign*.jpg)" )
+    parser.add_argument( "--max-rate", type=float, default=25.0,
+                         help="Maximum number of commands per second sent to the robot" )
+    parser.add_argument( "--control-rate", type=float, default=50.0,
+                         help="Ticks per second of the steering controller" )
+    parser.add_argument( "--max-frame-age", type=float, default=0.5,
+                         help="Seconds after which a camera frame is too old to act on (0 = no limit)" )
+    parser.add_argument( "--pipeline", action="store_true",
+                         help="Track the marker in a separate vision process" )
+    parser.add_argument( "--sign-denoise", default=sign_denoise, choices=sorted(sign_matching.denoisers),
+                         help="Denoiser of the sign extraction; see benchmark_vision.py --denoisers" )
+    parser.add_argument( "--sensor-rate", type=float, default=20.0,
+                         help="Sensor snapshots per second read by the background poller" )
+    parser.add_argument( "--turn-times", type=float, nargs=4, metavar=("RIGHT", "LEFT", "TURN", "SPIN"),
+                         help="Seconds of the timed turns (default: what time_out(65/100/170/34) took on this machine)" )
+    parser.add_argument( "--encoder-turns", action="store_true",
+                         help="Turn on encoder counts instead of calibrated times" )
+    parser.add_argument( "--ticks-per-cm", type=float, default=1.0,
+                         help="Encoder ticks per cm of wheel travel (calibrate with a straight run)" )
+    parser.add_argument( "--wheel-base", type=float, default=13.5,
+                         help="Distance between the wheels in cm (calibrate with a few spins)" )
+    parser.add_argument( "--trajectory", metavar="FILE",
+                         help="Write the dead-reckoning pose of every sensor snapshot to a CSV file" )
+    parser.add_argument( "--calibration", metavar="FILE",
+                         help="Colour calibration file (JSON HSV ranges); reloaded when it changes" )
+    parser.add_argument( "--change-threshold", type=int, default=12,
+                         help="Grey levels a signature cell must change before a frame is processed again (0 = only skip repeated images)" )
+    parser.add_argument( "--headless", action="store_true",
+                         help="No windows and no drawing at all (e.g. on the Raspberry Pi)" )
+    parser.add_argument( "--debug-fps", type=float, default=5.0,
+                         help="Maximum frames per second of the debug view" )
+    parser.add_argument( "--debug-video", metavar="FILE",
+                         help="Write the debug view to an MJPEG file instead of windows" )
+    parser.add_argument( "--timing-csv", metavar="FILE",
+                         help="Write the stage timings of every loop iteration to FILE" )
+    parser.add_argument( "--record", metavar="FILE",
+                         help="Store camera frames and sensor data of this run in FILE" )
+    parser.add_argument( "--replay", metavar="FILE",
+                         help="Use a recorded run instead of the robot" )
+    args = parser.parse_args()
+    if not args.headless:
+        debug = debug_view.DebugView( fps=args.debug_fps, video_path=args.debug_video )
+    if args.timing_csv:
+        timer.start_csv( args.timing_csv )
+    sign_denoise = args.sign_denoise
+    encoder_turns = args.encoder_turns
+    if args.turn_times:
+        turn_times = dict(zip(('RIGHT', 'LEFT', 'TURN', 'SPIN'), args.turn_times))
+    else:
+        turn_times = legacy_turn_times()
+    print 'Turn times RIGHT / LEFT / TURN / SPIN  %.3f / %.3f / %.3f / %.3f s' % (
+        turn_times['RIGHT'], turn_times['LEFT'], turn_times['TURN'], turn_times['SPIN'])
+    change_detector = change_detection.ChangeDetector( threshold=args.change_threshold )
+    trajectory_path = args.trajectory
+    #---------------------------------------------------------------------------------- Load the reference signs once
+    sign_templates = sign_matching.SignTemplates( args.signs )
+    marker_tracker = marker_tracking.MultiMarkerTracker( level=args.roi_level )
+    search_scheduler = marker_search.SearchScheduler( min_pan_angle, max_pan_angle, level=args.search_level )
+    #---------------------------------------------------------------------------------- Connect to the robot (or a recording of it)
+    if args.replay:
+        bot = bot_recording.ReplayBot( args.replay )
+    else:
+        #bot = connect_robot( args.hostname )
+        bot = connect_robot( "192.168.42.1" )
+        if args.record:
+            bot = bot_recording.RecordingBot( bot, args.record )
+    bot = command_scheduler.LockedBot( bot )                                          # one I/O lock for all threads
+    commands = command_scheduler.CommandScheduler( bot, max_rate=args.max_rate )
+    steering = steering_controller.SteeringController( commands, rate=args.control_rate, stop_range=max_range,
+                                                       clock=getattr(bot, 'clock', time.time) )
+    calibration = None
+    if args.calibration:
+        calibration = colour_calibration.ColourCalibration( lower_blue, upper_blue, path=args.calibration )
+        lower_blue, upper_blue = calibration.current()
+    camera = frame_cache.FrameSource( bot, lower_blue, upper_blue, max_age=args.max_frame_age,
+                                      calibration=calibration )
+    sensors = sensor_cache.SensorCache( bot, commands.motor_speeds, rate=args.sensor_rate,
+                                        ticks_per_cm=args.ticks_per_cm, wheel_base=args.wheel_base,
+                                        clock=getattr(bot, 'clock', time.time) )
+    sensors.start()
+    if args.pipeline:
+        vision = vision_pipeline.VisionPipeline( lower_blue, upper_blue, level=args.roi_level )
+        vision.start()
+    try:
+        main_loop()
+    except EOFError as error:                                                         # replay finished
+        print error
+    finally:
+        finalize()
@@ -0,0 +1,166 @@
+#! /usr/bin/python
+
+#-----------------------------------------------------------------------------------------------------------------------------------------------------------
+# Background sensor cache for reading_signs.py
+# - one thread asks the robot for its status at a fixed rate; the main loop and the obstacle checks read the
+#   latest snapshot (digital, analog A0, ultrasonic D12, encoders) without waiting for a round trip
+# - a snapshot is an immutable tuple that is replaced in one assignment: readers never see half an update
+# - encoder ticks are integrated into a dead-reckoning pose (x, y in cm; heading in radians); the encoders are
+#   single output, so the direction of each wheel is taken from the motor speeds last sent
+# - turn() spins the robot until the encoders counted the ticks of the requested angle (closed loop turns)
+#
+# ticks_per_cm and wheel_base depend on the wheels and encoder discs: calibrate them with a straight run of
+# known length and a few full spins before using --encoder-turns
+#-----------------------------------------------------------------------------------------------------------------------------------------------------------
+import collections
+import csv
+import math
+import threading
+import time
+import command_scheduler
+# -------------------------------------------------------------------------------------
+# Set and initialize variables
+# -------------------------------------------------------------------------------------
+encoder_wrap = 65536                                                                  # encoder counters of the mini driver are 16 bit
+SensorSnapshot = collections.namedtuple('SensorSnapshot',
+                                        'time digital analog_a0 ultrasonic encoders x y heading')
+# -------------------------------------------------------------------------------------
+# Returns: data of one sensor in the status dict of the robot, or None
+# -------------------------------------------------------------------------------------
+def reading(sensor_dict, name):
+    sensor = sensor_dict.get(name)
+    if not sensor:
+        return None
+    return sensor.get('data')
+
+class SensorCache(object):
+    def __init__(self, bot, motor_speeds, rate=20.0, max_age=0.5,
+                 ticks_per_cm=1.0, wheel_base=13.5, clock=time.time, history=10000):
+        self.bot = bot
+        self.motor_speeds = motor_speeds                                              # callable; (left, right) last sent
+        self.period = 1.0 / rate
+        self.max_age = max_age                                                        # seconds; older snapshots are read again
+        self.lock = threading.RLock()                                                 # pose and snapshot; bot I/O: LockedBot
+        self.ticks_per_cm = ticks_per_cm
+        self.wheel_base = wheel_base                                                  # cm between the wheels
+        self.clock = clock                                                            # clock of the status read times
+        self.snapshot = None
+        self.trajectory = collections.deque(maxlen=history)                           # (time, x, y, heading) per poll
+        self.x = 0.0
+        self.y = 0.0
+        self.heading = 0.0
+        self.last_encoders = None
+        self.polls = 0
+        self.blocking_reads = 0
+        self.thread = None
+        self.running = False
+    def start(self, timeout=1.0):                                                     # returns once the first snapshot is in
+        self.running = True
+        self.thread = threading.Thread(target=self.run)
+        self.thread.daemon = True
+        self.thread.start()
+        deadline = command_scheduler.monotonic() + timeout
+        while self.snapshot is None and self.running and command_scheduler.monotonic() < deadline:
+            time.sleep(0.005)
+    def stop(self):
+        self.running = False
+        if self.thread is not None:
+            self.thread.join(1.0)
+            self.thread = None
+    def run(self):
+        next_poll = command_scheduler.monotonic()
+        while self.running:
+            try:
+                self.poll()
+            except EOFError:                                                          # replay without (more) sensor data
+                self.running = False
+                break
+            next_poll += self.period
+            delay = next_poll - command_scheduler.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            else:
+                next_poll = command_scheduler.monotonic()                             # overrun; do not try to catch up
+    # ---------------------------------------------------------------------------------
+    # One status round trip; updates the pose and replaces the snapshot
+    #
+    # Returns: the new snapshot
+    # ---------------------------------------------------------------------------------
+    def poll(self):
+        with self.lock:
+            status_dict, read_time = self.bot.get_robot_status_dict()
+            sensor_dict = status_dict.get('sensors', {})
+            analog = reading(sensor_dict, 'analog')
+            encoders = reading(sensor_dict, 'encoders')
+            if encoders is not None:
+                encoders = tuple(encoders[:2])
+                self.integrate(encoders)
+            snapshot = SensorSnapshot(read_time or self.clock(), reading(sensor_dict, 'digital'),
+                                      analog[0] if analog else None, reading(sensor_dict, 'ultrasonic'),
+                                      encoders, self.x, self.y, self.heading)
+            self.snapshot = snapshot
+            self.trajectory.append((snapshot.time, self.x, self.y, self.heading))
+            self.polls += 1
+            return snapshot
+    # ---------------------------------------------------------------------------------
+    # Dead reckoning; the wheel directions are those of the motor speeds last sent
+    # ---------------------------------------------------------------------------------
+    def integrate(self, encoders):
+        last = self.last_encoders
+        self.last_encoders = encoders
+        if last is None:
+            return
+        left_speed, right_speed = self.motor_speeds()
+        left = (encoders[0] - last[0]) % encoder_wrap / self.ticks_per_cm
+        right = (encoders[1] - last[1]) % encoder_wrap / self.ticks_per_cm
+        if left_speed < 0:
+            left = -left
+        if right_speed < 0:
+            right = -right
+        distance = (left + right) / 2.0
+        turned = (right - left) / self.wheel_base
+        self.x += distance * math.cos(self.heading + turned / 2.0)
+        self.y += distance * math.sin(self.heading + turned / 2.0)
+        self.heading = (self.heading + turned + math.pi) % (2.0 * math.pi) - math.pi
+    # ---------------------------------------------------------------------------------
+    # Returns: the latest snapshot; read at once (blocking) when the poller fell behind
+    # ---------------------------------------------------------------------------------
+    def latest(self):
+        snapshot = self.snapshot
+        if snapshot is None or self.clock() - snapshot.time > self.max_age:
+            self.blocking_reads += 1
+            snapshot = self.poll()
+        return snapshot
+    # ---------------------------------------------------------------------------------
+    # Spin until the wheels counted the ticks of the requested angle, or the timeout passed
+    #
+    # Returns: None without encoder data (nothing done), else True when the angle was reached
+    # ---------------------------------------------------------------------------------
+    def turn(self, commands, left, right, degrees, timeout):
+        start = self.poll()                                                           # fresh counts; a cached one may be a period old
+        if start.encoders is None:
+            return None
+        ticks = math.radians(abs(degrees)) * self.wheel_base / 2.0 * self.ticks_per_cm
+        reached = False
+        deadline = command_scheduler.monotonic() + timeout
+        commands.set_motor_speeds(left, right)
+        commands.flush()
+        next_poll = command_scheduler.monotonic()
+        while command_scheduler.monotonic() < deadline:
+            encoders = self.poll().encoders                                           # poll now; not a cached snapshot
+            counted = ((encoders[0] - start.encoders[0]) % encoder_wrap +
+                       (encoders[1] - start.encoders[1]) % encoder_wrap) / 2.0
+            if counted >= ticks:
+                reached = True
+                break
+            next_poll += self.period                                                  # at the cache rate; sends what is due meanwhile
+            commands.wait_until(min(next_poll, deadline))
+        commands.set_motor_speeds(0.0, 0.0)
+        commands.flush()
+        return reached
+    def write_trajectory(self, path):
+        with open(path, 'wb') as csv_file:
+            writer = csv.writer(csv_file)
+            writer.writerow(('time', 'x', 'y', 'heading'))
+            for row in list(self.trajectory):
+                writer.writerow(['%.3f' % value for value in row])
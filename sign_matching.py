@@ -0,0 +1,125 @@
+#! /usr/bin/python
+
+#-----------------------------------------------------------------------------------------------------------------------------------------------------------
+# Sign template bank for reading_signs.py
+# - reads every sign image (sign*.jpg) from a directory once at startup
+# - blurs and thresholds them the same way as the warped sign found by the camera
+# - stacks all templates into one contiguous array so a sign is scored against every
+#   template in a single batched operation (no disk reads or float copies per sign)
+#
+# The name of a sign is taken from its file name: signright.jpg -> 'RIGHT', signstop.jpg -> 'STOP'
+#
+# extract_quads finds the candidate sign rectangles inside a padded crop of the marker box only,
+# with a selectable denoiser (benchmark_vision.py --denoisers compares them on recorded runs)
+#-----------------------------------------------------------------------------------------------------------------------------------------------------------
+import os
+import glob
+import cv2
+import numpy as np
+# -------------------------------------------------------------------------------------
+# Set and initialize variables
+# -------------------------------------------------------------------------------------
+NO_MATCH = 'NO MATCH'
+max_mse = 5000.0                                                                      # Above this the sign does not match any template
+min_quad_area = 5000                                                                  # pixels; smaller rectangles are no sign
+denoisers = {                                                                         # on the masked colour image; slowest first
+    'bilateral': lambda image: cv2.bilateralFilter(image, 9, 75, 75),
+    'median':    lambda image: cv2.medianBlur(image, 5),
+    'gaussian':  lambda image: cv2.GaussianBlur(image, (5,5), 0),
+    'none':      lambda image: image,
+}
+# -------------------------------------------------------------------------------------
+# Padded crop around the marker box; the sign is inside the marker
+#
+# Returns: roi (x0, y0, x1, y1)
+# -------------------------------------------------------------------------------------
+def sign_roi(box, shape, pad_fraction=0.1, min_pad=10):
+    x, y, w, h = box
+    pad = max(min_pad, int(pad_fraction * max(w, h)))
+    height, width = shape[:2]
+    return (max(0, x - pad), max(0, y - pad),
+            min(width, x + w + pad), min(height, y + h + pad))
+# -------------------------------------------------------------------------------------
+# Filter inner sign area
+#
+# Input: Frame, optional roi (x0, y0, x1, y1), name of the denoiser
+# Returns: all candidate rectangles (4 points, full frame coordinates), smallest first
+# -------------------------------------------------------------------------------------
+def extract_quads(frame, roi=None, denoise='bilateral'):
+    x0, y0 = 0, 0
+    if roi is not None:
+        x0, y0, x1, y1 = roi
+        frame = frame.sub_frame(x0, y0, x1, y1)
+    result_image = denoisers[denoise](frame.masked)                                   # 0..3 - Blue masked; de-noised
+    result_image = cv2.cvtColor(result_image, cv2.COLOR_BGR2GRAY )                    # 4 - Convert to Gray (needed for binarizing)
+    result_image = cv2.Canny(result_image,threshold1=90, threshold2=190)              # 5 - Find edges of all shapes
+    contours, _ = cv2.findContours(result_image,
+                                   cv2.RETR_LIST,
+                                   cv2.CHAIN_APPROX_SIMPLE)                           # 6 - Find contours of all shapes
+    contours = sorted(contours, key=cv2.contourArea, reverse=True) [:4]               # 7 - Select biggest 4; drop the rest
+    quads = []
+    for cnt in contours:
+        area = cv2.contourArea(cnt)
+        epsilon = 0.1*cv2.arcLength(cnt,True)
+        approx = cv2.approxPolyDP(cnt,epsilon,True)
+        if len (approx) == 4 and area > min_quad_area:                               # 8 - Keep every alleged rectangle
+            quads.append((area, approx + np.array([x0, y0], dtype=approx.dtype)))
+    quads.sort(key=lambda quad: quad[0])
+    return [quad for area, quad in quads]
+# -------------------------------------------------------------------------------------
+# Blurring and thresholding to assure the pictures corrolate in values with the printed sign
+#
+# Input: gray image
+# Returns: binary image
+# -------------------------------------------------------------------------------------
+def preprocess_sign(gray_image):
+    gray_image = cv2.GaussianBlur(gray_image,(5,5),0)
+    _,binary_image = cv2.threshold(gray_image,0,255,cv2.THRESH_BINARY+cv2.THRESH_OTSU)
+    return binary_image
+# -------------------------------------------------------------------------------------
+# All reference signs, preprocessed and stacked as rows of one float32 matrix
+# -------------------------------------------------------------------------------------
+class SignTemplates(object):
+    def __init__(self, directory='.', pattern='sign*.jpg'):
+        print 'Reading reference images ............'
+        self.names = []
+        images = []
+        for file_name in sorted(glob.glob(os.path.join(directory, pattern))):
+            template = cv2.imread(file_name, 0)
+            if template is None:
+                print 'Error reading file !!!', file_name
+                continue
+            template = preprocess_sign(template)
+            if images and template.shape != images[0].shape:                         # equalize shapes with the first template
+                (hc, wc) = images[0].shape
+                template = cv2.resize(template, (wc,hc), interpolation=cv2.INTER_AREA)
+            name = os.path.splitext(os.path.basename(file_name))[0].lower()
+            if name.startswith('sign') and len(name) > 4:
+                name = name[4:]
+            self.names.append(name.upper())
+            images.append(template)
+        if not images:
+            raise IOError('No sign templates %s found in %s' % (pattern, directory))
+        self.shape = images[0].shape
+        self.bank = np.ascontiguousarray(np.array(images, dtype=np.float32).reshape(len(images), -1))
+        self.bank_squared = np.einsum('ij,ij->i', self.bank, self.bank)             # |T|^2 per template, computed once
+        print 'Signs loaded ........................', ', '.join(self.names)
+    # ---------------------------------------------------------------------------------
+    # Mean Squared Error of the sign against all templates at once:
+    # |S - T|^2 = |S|^2 - 2 S.T + |T|^2
+    #
+    # Input: preprocessed sign resized to self.shape
+    # Returns: best name (or NO_MATCH), its MSE and the margin over the runner-up (None with one template)
+    # ---------------------------------------------------------------------------------
+    def match(self, sign_image):
+        sign = sign_image.reshape(-1).astype(np.float32)
+        scores = (self.bank_squared - 2.0 * self.bank.dot(sign) + sign.dot(sign)) / sign.size
+        order = np.argsort(scores)
+        best = order[0]
+        score = float(scores[best])
+        margin = None
+        if len(order) > 1:
+            margin = float(scores[order[1]]) - score
+        if score > max_mse:
+            return NO_MATCH, score, margin
+        return self.names[best], score, margin
@@ -0,0 +1,119 @@
+#! /usr/bin/python
+
+#-----------------------------------------------------------------------------------------------------------------------------------------------------------
+# Hot path instrumentation for reading_signs.py
+# - record(stage, start) after each stage: frame fetch, change detection, HSV/mask, contours, sign filter, warp, matching,
+#   sensor read and motor command
+# - keeps a rolling window of latencies per stage (percentiles) and an all-time histogram
+# - frame_age: time between capture of a frame and the motor command based on it
+# - queue_delay: time a motor command waited in the command scheduler (rate limit) before it went out
+# - optional CSV with one row per loop iteration, written by a background thread
+# - one clock call and a deque append per stage: cheap enough to leave on in production runs
+#
+# Usage: start = stage_timing.clock()
+#        ... stage ...
+#        stage_timing.timer.record('contours', start)
+#-----------------------------------------------------------------------------------------------------------------------------------------------------------
+import bisect
+import collections
+import csv
+import threading
+import time
+import timeit
+import Queue
+import numpy as np
+# -------------------------------------------------------------------------------------
+# Set and initialize variables
+# -------------------------------------------------------------------------------------
+clock = timeit.default_timer
+STAGES = ('frame_fetch', 'change_detect', 'hsv_mask', 'contours', 'sign_filter', 'warp',
+          'matching', 'sensor_read', 'motor_command', 'queue_delay', 'frame_age')
+bucket_edges = (0.1, 0.2, 0.5, 1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)            # ms; last bucket is > 1000 ms
+# -------------------------------------------------------------------------------------
+# Latencies per stage
+# -------------------------------------------------------------------------------------
+class StageTimer(object):
+    def __init__(self, window=1000):
+        self.enabled = True
+        self.window = window
+        self.latencies = {}                                                           # stage -> rolling window (ms)
+        self.histograms = {}                                                          # stage -> counts per bucket
+        self.iteration = {}                                                           # stage -> ms in this loop iteration
+        self.iteration_count = 0
+        self.csv_queue = None
+        self.csv_thread = None
+    def add(self, stage, ms):
+        if stage not in self.latencies:
+            self.latencies[stage] = collections.deque(maxlen=self.window)
+            self.histograms[stage] = [0] * (len(bucket_edges) + 1)
+        self.latencies[stage].append(ms)
+        self.histograms[stage][bisect.bisect_left(bucket_edges, ms)] += 1
+        self.iteration[stage] = self.iteration.get(stage, 0.0) + ms
+    def median(self, stage, default=None):                                           # ms over the rolling window
+        latencies = self.latencies.get(stage)
+        if not latencies:
+            return default
+        return float(np.median(list(latencies)))
+    def record(self, stage, start):
+        if self.enabled:
+            self.add(stage, (clock() - start) * 1000.0)
+    # ---------------------------------------------------------------------------------
+    # Input: capture time of the frame a motor command is based on and the time now, both on the
+    #        clock of the bot (time.time() of the robot; the recorded clock in a replay)
+    # ---------------------------------------------------------------------------------
+    def frame_age(self, capture_time, now=None):
+        if self.enabled and capture_time:
+            if now is None:
+                now = time.time()
+            self.add('frame_age', (now - capture_time) * 1000.0)
+    # ---------------------------------------------------------------------------------
+    # Close a loop iteration; its stage totals go to the CSV thread
+    # ---------------------------------------------------------------------------------
+    def end_iteration(self):
+        if self.csv_queue is not None:
+            self.csv_queue.put((self.iteration_count, time.time(), self.iteration))
+        self.iteration = {}
+        self.iteration_count += 1
+    def start_csv(self, path):
+        self.csv_queue = Queue.Queue()
+        self.csv_thread = threading.Thread(target=self.write_csv, args=(path,))
+        self.csv_thread.daemon = True
+        self.csv_thread.start()
+    def write_csv(self, path):
+        with open(path, 'wb') as csv_file:
+            writer = csv.writer(csv_file)
+            writer.writerow(('iteration', 'time') + STAGES)
+            while True:
+                row = self.csv_queue.get()
+                if row is None:
+                    break
+                iteration, wall_time, stages = row
+                writer.writerow([iteration, '%.3f' % wall_time] +
+                                ['%.3f' % stages[stage] if stage in stages else '' for stage in STAGES])
+    def close(self):
+        if self.csv_thread is not None:
+            self.csv_queue.put(None)
+            self.csv_thread.join(2.0)
+            self.csv_thread = None
+    # ---------------------------------------------------------------------------------
+    # Summary of all stages; printed at shutdown
+    # ---------------------------------------------------------------------------------
+    def report(self):
+        if not self.latencies:
+            return
+        print 'Stage timing (ms) over the last %d samples; %d loop iterations' % (self.window, self.iteration_count)
+        print '%-14s %7s %8s %8s %8s %8s %8s' % ('stage', 'count', 'mean', 'p50', 'p90', 'p99', 'max')
+        stages = [stage for stage in STAGES if stage in self.latencies]
+        stages += sorted(stage for stage in self.latencies if stage not in STAGES)
+        for stage in stages:
+            latencies = np.array(self.latencies[stage])
+            p50, p90, p99 = np.percentile(latencies, [50, 90, 99])
+            print '%-14s %7d %8.2f %8.2f %8.2f %8.2f %8.2f' % (stage, sum(self.histograms[stage]), latencies.mean(),
+                                                                p50, p90, p99, latencies.max())
+        print 'Histogram buckets (ms) <=', ' '.join('%g' % edge for edge in bucket_edges), '>'
+        for stage in stages:
+            print '%-14s' % stage, ' '.join('%d' % count for count in self.histograms[stage])
+# -------------------------------------------------------------------------------------
+# One timer for the whole script
+# -------------------------------------------------------------------------------------
+timer = StageTimer()
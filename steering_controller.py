@@ -0,0 +1,131 @@
+#! /usr/bin/python
+
+#-----------------------------------------------------------------------------------------------------------------------------------------------------------
+# Fixed rate steering controller for MOVE_TO_MARKER in reading_signs.py
+# - runs on its own thread at a fixed tick, independent of the camera and vision rate
+# - takes the latest vision estimate (centre x, width and their velocities) and extrapolates it by its age
+#   plus the measured command latency (median time in the scheduler queue plus median send time, both from
+#   stage_timing), instead of waiting for the next frame
+# - PID steering on the centroid error; speed scheduled on the estimated range (16175.288 / w)
+# - stops when the range predicted at the moment the command takes effect reaches stop_range,
+#   so the stopping point follows the measured loop latency instead of a fixed safety factor
+# - gives up (lost) when there was no fresh estimate for lost_time seconds, so the main loop can search again;
+#   an error in a tick stops the motors and ends the thread
+#-----------------------------------------------------------------------------------------------------------------------------------------------------------
+import threading
+import time
+import command_scheduler
+from stage_timing import timer
+# -------------------------------------------------------------------------------------
+# Set and initialize variables
+# -------------------------------------------------------------------------------------
+focal_width = 16175.288                                                               # real width * focal length
+image_centre = 320
+image_width = 640.0
+
+class SteeringController(object):
+    def __init__(self, commands, rate=50.0, kp=55.0, ki=0.0, kd=2.0,
+                 min_speed=30.0, max_speed=60.0, speed_per_cm=0.5, stop_range=40.0,
+                 brake_time=0.0, max_age=0.5, lost_time=1.5, clock=time.time):
+        self.commands = commands                                                      # CommandScheduler
+        self.period = 1.0 / rate
+        self.kp = kp                                                                  # motor % per unit of error (-0.5 .. 0.5)
+        self.ki = ki
+        self.kd = kd
+        self.min_speed = min_speed                                                    # motor % near the marker
+        self.max_speed = max_speed                                                    # motor % far away
+        self.speed_per_cm = speed_per_cm                                              # extra motor % per cm of range left
+        self.stop_range = stop_range                                                  # cm
+        self.brake_time = brake_time                                                  # seconds the robot rolls on after a stop; measure first
+        self.max_age = max_age                                                        # seconds; older estimates stop the robot
+        self.lost_time = lost_time                                                    # seconds without a fresh estimate: marker lost
+        self.clock = clock                                                            # clock of the frame timestamps
+        self.estimate = None
+        self.thread = None
+        self.running = False
+        self.arrived = False
+        self.lost = False
+        self.error = None
+        self.speed_adjust = 0.0
+        self.range = 0.0
+    # ---------------------------------------------------------------------------------
+    # Latest vision estimate; one tuple assignment, safe to call from the vision loop
+    #
+    # Input: capture time, centre x, width (pixels), their velocities (pixels per second)
+    # ---------------------------------------------------------------------------------
+    def observe(self, timestamp, centre_x, width, velocity_x=0.0, velocity_w=0.0):
+        self.estimate = (timestamp, centre_x, width, velocity_x, velocity_w)
+    def latency(self):                                                                # seconds from decision to command at the robot
+        return (timer.median('queue_delay', 0.0) + timer.median('motor_command', 0.0)) / 1000.0 + self.brake_time
+    def start(self):
+        self.estimate = None
+        self.arrived = False
+        self.lost = False
+        self.error = None
+        self.started = self.clock()
+        self.integral = 0.0
+        self.previous_error = None
+        self.running = True
+        self.thread = threading.Thread(target=self.run)
+        self.thread.daemon = True
+        self.thread.start()
+    def stop(self):
+        self.running = False
+        if self.thread is not None:
+            self.thread.join(1.0)
+            self.thread = None
+    def alive(self):
+        return self.thread is not None and self.thread.is_alive()
+    def run(self):
+        next_tick = command_scheduler.monotonic()
+        while self.running:
+            try:
+                self.tick()
+            except Exception as error:                                                # never leave the motors running
+                self.error = error
+                self.running = False
+                print 'Steering stopped ....................', repr(error)
+                self.commands.set_motor_speeds(0.0, 0.0)
+                self.commands.flush()
+                break
+            next_tick += self.period
+            delay = next_tick - command_scheduler.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            else:
+                next_tick = command_scheduler.monotonic()                             # overrun; do not try to catch up
+    # ---------------------------------------------------------------------------------
+    # One control step
+    # ---------------------------------------------------------------------------------
+    def tick(self):
+        estimate = self.estimate
+        now = self.clock()
+        if estimate is None or now - estimate[0] > self.max_age:                      # vision lost; do not drive blind
+            self.commands.set_motor_speeds(0.0, 0.0)
+            since = self.started
+            if estimate is not None:
+                since = max(since, estimate[0])
+            if now - since > self.lost_time:                                          # back to the search
+                self.lost = True
+                self.running = False
+            return
+        timestamp, centre_x, width, velocity_x, velocity_w = estimate
+        ahead = now - timestamp + self.latency()                                      # where the marker is when the command acts
+        centre_x = centre_x + velocity_x * ahead
+        width = max(1.0, width + velocity_w * ahead)
+        self.range = focal_width / width
+        if self.range <= self.stop_range:
+            self.commands.set_motor_speeds(0.0, 0.0)
+            self.arrived = True
+            self.running = False
+            return
+        error = (centre_x - image_centre) / image_width
+        self.integral += error * self.period
+        derivative = 0.0
+        if self.previous_error is not None:
+            derivative = (error - self.previous_error) / self.period
+        self.previous_error = error
+        self.speed_adjust = round(self.kp * error + self.ki * self.integral + self.kd * derivative, 1)
+        speed = self.min_speed + (self.range - self.stop_range) * self.speed_per_cm
+        speed = round(min(self.max_speed, max(self.min_speed, speed)), 1)
+        self.commands.set_motor_speeds(speed + self.speed_adjust, speed - self.speed_adjust, timestamp)
@@ -0,0 +1,135 @@
+#! /usr/bin/python
+
+#-----------------------------------------------------------------------------------------------------------------------------------------------------------
+# Pipelined marker tracking for reading_signs.py
+# - the control loop drops camera frames into a fixed size ring buffer in shared memory
+# - a vision worker process wraps the newest slot in a NumPy view (no copy, no pickling),
+#   tracks the markers (MultiMarkerTracker; Kalman filters) and publishes the box, ID and velocities
+#   of the primary marker
+# - the control loop only ever consumes the newest result; it never waits for vision
+#
+# A slot holds: sequence number, capture time and epoch (incremented by reset(), e.g. after the neck moved)
+# The sequence number of a slot is checked again after processing: if the writer lapped the worker,
+# the result is dropped.
+# The worker gets the colour ranges of the moment it starts; a later recalibration does not reach it.
+#-----------------------------------------------------------------------------------------------------------------------------------------------------------
+import multiprocessing
+import multiprocessing.sharedctypes
+import numpy as np
+import frame_cache
+import marker_tracking
+# -------------------------------------------------------------------------------------
+# Set and initialize variables
+# -------------------------------------------------------------------------------------
+SLOT_SEQ = 0                                                                          # per slot metadata
+SLOT_TIME = 1
+SLOT_EPOCH = 2
+SLOT_FIELDS = 3
+RESULT_FIELDS = 13                                                                    # seq, time, epoch, found, x, y, w, h,
+                                                                                      # track id, centre x, width, vx, vw
+# -------------------------------------------------------------------------------------
+# Worker process: track the marker in the newest frame of the ring
+# -------------------------------------------------------------------------------------
+def vision_worker(ring_buffer, slot_meta, latest_seq, result, frame_ready, stop,
+                  shape, slots, lower_blue, upper_blue, level):
+    ring = np.frombuffer(ring_buffer, dtype=np.uint8).reshape((slots,) + shape)
+    tracker = marker_tracking.MultiMarkerTracker(level=level)
+    done_seq = -1
+    epoch = None
+    while not stop.is_set():
+        if not frame_ready.wait(0.1):
+            continue
+        frame_ready.clear()
+        seq = latest_seq.value
+        if seq == done_seq:
+            continue
+        slot = seq % slots
+        meta = slot * SLOT_FIELDS
+        if slot_meta[meta + SLOT_SEQ] != seq:                                         # being rewritten
+            continue
+        timestamp = slot_meta[meta + SLOT_TIME]
+        if slot_meta[meta + SLOT_EPOCH] != epoch:
+            epoch = slot_meta[meta + SLOT_EPOCH]
+            tracker.reset()
+        found = tracker.find(frame_cache.Frame(ring[slot], lower_blue, upper_blue, timestamp, seq))
+        if slot_meta[meta + SLOT_SEQ] != seq:                                         # lapped by the writer; pixels changed
+            continue
+        track = tracker.primary()
+        if found is None or track is None:
+            values = [seq, timestamp, epoch, 0, 0, 0, 1, 0, 0, 0, 0, 0, 0]
+        else:
+            x, y, w, h, _ = found
+            cx, cy, tw, vx, vy, vw = track.state
+            values = [seq, timestamp, epoch, 1, x, y, w, h, track.id, cx, tw, vx, vw]
+        with result.get_lock():
+            result[:] = values
+        done_seq = seq
+# -------------------------------------------------------------------------------------
+# Shared memory ring buffer and its worker
+# -------------------------------------------------------------------------------------
+class VisionPipeline(object):
+    def __init__(self, lower_blue, upper_blue, shape=(480, 640, 3), slots=4, level=0):
+        self.shape = tuple(shape)
+        self.slots = slots
+        size = int(np.prod(self.shape))
+        self.ring_buffer = multiprocessing.sharedctypes.RawArray('B', slots * size)
+        self.ring = np.frombuffer(self.ring_buffer, dtype=np.uint8).reshape((slots,) + self.shape)
+        self.slot_meta = multiprocessing.sharedctypes.RawArray('d', [-1.0] * (slots * SLOT_FIELDS))
+        self.latest_seq = multiprocessing.Value('l', -1, lock=False)
+        self.result = multiprocessing.Array('d', [-1.0] * RESULT_FIELDS)
+        self.frame_ready = multiprocessing.Event()
+        self.stop = multiprocessing.Event()
+        self.seq = -1
+        self.epoch = 0
+        self.worker = multiprocessing.Process(target=vision_worker,
+                                              args=(self.ring_buffer, self.slot_meta, self.latest_seq,
+                                                    self.result, self.frame_ready, self.stop,
+                                                    self.shape, slots, lower_blue, upper_blue, level))
+        self.worker.daemon = True
+    def start(self):
+        self.worker.start()
+    # ---------------------------------------------------------------------------------
+    # Copy a camera image into the next slot and wake the worker
+    # ---------------------------------------------------------------------------------
+    def submit(self, image, timestamp):
+        if image.shape != self.shape:
+            raise ValueError('Frame shape %s does not match ring shape %s' % (image.shape, self.shape))
+        self.seq += 1
+        slot = self.seq % self.slots
+        meta = slot * SLOT_FIELDS
+        self.slot_meta[meta + SLOT_SEQ] = -1                                          # mark as being written
+        self.ring[slot][...] = image
+        self.slot_meta[meta + SLOT_TIME] = timestamp
+        self.slot_meta[meta + SLOT_EPOCH] = self.epoch
+        self.slot_meta[meta + SLOT_SEQ] = self.seq
+        self.latest_seq.value = self.seq
+        self.frame_ready.set()
+    # ---------------------------------------------------------------------------------
+    # Forget the tracked marker (neck or robot moved); older results are ignored
+    # ---------------------------------------------------------------------------------
+    def reset(self):
+        self.epoch += 1
+    # ---------------------------------------------------------------------------------
+    # Returns: seq, capture time, (x, y, w, h) or None, (track id, centre x, width, vx, vw) or None;
+    #          None if no result yet for this epoch
+    # ---------------------------------------------------------------------------------
+    def latest(self):
+        with self.result.get_lock():
+            values = self.result[:]
+        seq, timestamp, epoch, found = values[:4]
+        if seq < 0 or epoch != self.epoch:
+            return None
+        if found:
+            box = tuple(int(v) for v in values[4:8])
+            track = (int(values[8]),) + tuple(values[9:13])
+        else:
+            box = None
+            track = None
+        return int(seq), timestamp, box, track
+    def close(self, timeout=1.0):
+        self.stop.set()
+        self.frame_ready.set()
+        if self.worker.is_alive():
+            self.worker.join(timeout)
+            if self.worker.is_alive():
+                self.worker.terminate()